@@ -5,7 +5,7 @@ Pilotable depuis n8n comme l'API vidéo
 Usage: python3 api_duaa_images.py
 """
 
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, request, send_file, jsonify, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageEnhance
 from pathlib import Path
@@ -15,62 +15,248 @@ from datetime import datetime
 import threading
 import requests
 import sys
+import logging
+import logging.handlers
+import atexit
 import time
 from collections import deque
-import builtins
 import os
 import re
 from unicodedata import normalize
 import random
+import hashlib
+import itertools
+import math
+import queue
+import sqlite3
+import shutil
+import zipfile
+import warnings
+import bisect
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from io import BytesIO
+from collections import OrderedDict
 from arabic_reshaper import ArabicReshaper
 from bidi.algorithm import get_display
 
-# ============================================
-# RATE LIMITING POUR RAILWAY
-# ============================================
-class RateLimitedPrint:
-    """Limite les print() à 15/sec pour éviter Railway rate limit"""
-    def __init__(self, max_per_second=15):
-        self.max_per_second = max_per_second
-        self.timestamps = deque(maxlen=max_per_second)
-        self.original_print = builtins.print
-        self.dropped = 0
-        self.last_report = time.time()
-        
-    def __call__(self, *args, **kwargs):
-        now = time.time()
-        
-        while self.timestamps and now - self.timestamps[0] > 1.0:
-            self.timestamps.popleft()
-        
-        if len(self.timestamps) < self.max_per_second:
-            self.timestamps.append(now)
-            self.original_print(*args, **kwargs, file=sys.stderr)
-            
-            if self.dropped > 0 and now - self.last_report > 5.0:
-                self.original_print(f"⚠️ {self.dropped} logs supprimés", file=sys.stderr)
-                self.dropped = 0
-                self.last_report = now
-        else:
-            self.dropped += 1
-
-print = RateLimitedPrint(max_per_second=15)
-
 # ============================================
 # CONFIGURATION
 # ============================================
+def available_cpus():
+    """CPU réellement utilisables: affinité du processus, plafonnée par le quota cgroup (conteneur)"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = None
+    try:
+        # cgroup v2: "<quota> <période>" ou "max <période>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            limit, period = f.read().split()
+        if limit != 'max':
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                limit = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+            if limit > 0 and period > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return max(1, cpus)
+
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50 MB
 app.config['OUTPUT_FOLDER'] = 'outputs'
 app.config['TEMP_FOLDER'] = 'temp'
 app.config['BACKGROUNDS_FOLDER'] = 'backgrounds'
 app.config['FONTS_FOLDER'] = 'fonts'
+app.config['DATA_FOLDER'] = 'data'
+app.config['JOB_STORE'] = os.environ.get('JOB_STORE', 'sqlite')  # sqlite, memory, redis
+app.config['JOB_STORE_PATH'] = os.environ.get('JOB_STORE_PATH', os.path.join(app.config['DATA_FOLDER'], 'jobs.sqlite3'))
+app.config['REDIS_URL'] = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+app.config['WARMUP'] = os.environ.get('WARMUP', '1') != '0'  # Préchauffage (polices, reshaper, un rendu) avant d'accepter du trafic
+app.config['FALLBACK_FONT_DOWNLOAD'] = os.environ.get('FALLBACK_FONT_DOWNLOAD', '1') != '0'  # Au démarrage seulement, si fonts/ n'a aucune police arabe
+app.config['FONT_CACHE_SIZE'] = int(os.environ.get('FONT_CACHE_SIZE', 32))  # Polices (chemin, taille) gardées en mémoire
+app.config['SHAPING_CACHE_SIZE'] = int(os.environ.get('SHAPING_CACHE_SIZE', 4096))  # Textes reshapés + bidi gardés en mémoire
+app.config['WORD_WIDTH_CACHE_SIZE'] = int(os.environ.get('WORD_WIDTH_CACHE_SIZE', 16384))  # Largeurs (police, mot) mesurées
+app.config['TEXT_MASK_CACHE_MB'] = int(os.environ.get('TEXT_MASK_CACHE_MB', 64))  # Masques de lignes de texte rasterisées
+app.config['GRADIENT_CACHE_SIZE'] = int(os.environ.get('GRADIENT_CACHE_SIZE', 16))  # Fonds dégradés prêts à l'emploi
+app.config['BG_CACHE_FOLDER'] = os.path.join(app.config['TEMP_FOLDER'], 'bg_cache')
+app.config['BG_SOURCE_MEMORY_MB'] = int(os.environ.get('BG_SOURCE_MEMORY_MB', 64))  # Octets bruts des fonds (mémoire)
+app.config['BG_SOURCE_DISK_MB'] = int(os.environ.get('BG_SOURCE_DISK_MB', 512))  # Octets bruts des fonds (disque)
+app.config['BG_PROCESSED_MEMORY_MB'] = int(os.environ.get('BG_PROCESSED_MEMORY_MB', 256))  # Fonds finis (recadrés, floutés)
+app.config['BG_REVALIDATE_SECONDS'] = int(os.environ.get('BG_REVALIDATE_SECONDS', 300))  # Délai avant revalidation ETag
+app.config['DOWNLOAD_MAX_MB'] = float(os.environ.get('DOWNLOAD_MAX_MB', 25))  # Taille max d'un fichier téléchargé
+app.config['DOWNLOAD_TIMEOUT'] = float(os.environ.get('DOWNLOAD_TIMEOUT', 30))  # Connexion / lecture (secondes)
+app.config['DOWNLOAD_RETRIES'] = int(os.environ.get('DOWNLOAD_RETRIES', 3))  # Nouvelles tentatives (erreurs réseau, 429, 5xx)
+app.config['DOWNLOAD_BACKOFF'] = float(os.environ.get('DOWNLOAD_BACKOFF', 0.5))  # Attente exponentielle entre tentatives
+app.config['DOWNLOAD_PER_HOST'] = int(os.environ.get('DOWNLOAD_PER_HOST', 4))  # Téléchargements simultanés par hôte
+app.config['MAX_IMAGE_PIXELS'] = int(os.environ.get('MAX_IMAGE_PIXELS', 80_000_000))  # Garde anti "decompression bomb"
+app.config['WORKER_POOL_SIZE'] = int(os.environ.get('WORKER_POOL_SIZE', available_cpus()))  # Rendus simultanés par worker
+app.config['RENDER_ENGINE'] = os.environ.get('RENDER_ENGINE', 'thread')  # thread (par défaut) ou process (pool de processus)
+app.config['RENDER_PROCESSES'] = int(os.environ.get('RENDER_PROCESSES', available_cpus()))  # Processus de rendu si RENDER_ENGINE=process
+app.config['JOB_QUEUE_SIZE'] = int(os.environ.get('JOB_QUEUE_SIZE', 64))  # Jobs en attente avant de répondre 429
+app.config['TEMPLATES_FOLDER'] = os.path.join(app.config['DATA_FOLDER'], 'templates')
+app.config['TEMPLATE_CACHE_MB'] = int(os.environ.get('TEMPLATE_CACHE_MB', 128))  # Bases précomposées des templates
+app.config['RENDER_CACHE_MAX_MB'] = int(os.environ.get('RENDER_CACHE_MAX_MB', 1024))  # Rendus adressés par contenu dans outputs/
+app.config['RENDER_CACHE_MAX_AGE_HOURS'] = float(os.environ.get('RENDER_CACHE_MAX_AGE_HOURS', 24 * 7))
+app.config['BATCH_MAX_ITEMS'] = int(os.environ.get('BATCH_MAX_ITEMS', 500))  # Éléments max par batch
+app.config['BATCH_PARALLELISM'] = int(os.environ.get('BATCH_PARALLELISM', app.config['WORKER_POOL_SIZE']))  # Rendus parallèles par batch
+app.config['RENDER_TIMEOUT'] = int(os.environ.get('RENDER_TIMEOUT', 120))  # Attente max de /api/render (secondes)
+# Long-poll max de /api/status?wait= (secondes), plafonné sous l'intervalle du healthcheck:
+# un long-poll occupe un thread gunicorn pendant toute l'attente
+app.config['STATUS_MAX_WAIT'] = min(int(os.environ.get('STATUS_MAX_WAIT', 20)), 25)
+app.config['BLUR_DOWNSCALE_MIN_RADIUS'] = float(os.environ.get('BLUR_DOWNSCALE_MIN_RADIUS', 4))  # Flou calculé en basse résolution au-delà
+app.config['JANITOR_INTERVAL'] = int(os.environ.get('JANITOR_INTERVAL', 60))  # Secondes entre deux passages du nettoyage
+app.config['OUTPUT_TTL_HOURS'] = float(os.environ.get('OUTPUT_TTL_HOURS', 24))  # Durée de vie des images publiées dans outputs/
+app.config['OUTPUT_MAX_MB'] = int(os.environ.get('OUTPUT_MAX_MB', 1024))  # Quota des images publiées (hors cache ca-*)
+app.config['JOB_TTL_HOURS'] = float(os.environ.get('JOB_TTL_HOURS', 24))  # Durée de vie d'un job après sa dernière mise à jour
+app.config['JOB_MAX_RECORDS'] = int(os.environ.get('JOB_MAX_RECORDS', 10000))  # Jobs conservés au maximum
+app.config['TEMP_TTL_HOURS'] = float(os.environ.get('TEMP_TTL_HOURS', 6))  # Fichiers orphelins de temp/ et fichiers .tmp
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO').upper()  # DEBUG affiche aussi le détail de chaque rendu
+app.config['LOG_RATE_LIMIT'] = int(os.environ.get('LOG_RATE_LIMIT', 15))  # Lignes/seconde max (limite Railway)
+app.config['LOG_REPEAT_LIMIT'] = int(os.environ.get('LOG_REPEAT_LIMIT', 20))  # Lignes max d'un même message par 10 s (0 = illimité)
+app.config['LOG_QUEUE_SIZE'] = int(os.environ.get('LOG_QUEUE_SIZE', 10000))  # Lignes en attente d'écriture sur stderr
 
 # Créer les dossiers
 for folder in [app.config['OUTPUT_FOLDER'], app.config['TEMP_FOLDER'], 
-               app.config['BACKGROUNDS_FOLDER'], app.config['FONTS_FOLDER']]:
+               app.config['BACKGROUNDS_FOLDER'], app.config['FONTS_FOLDER'],
+               app.config['BG_CACHE_FOLDER'], app.config['DATA_FOLDER'],
+               app.config['TEMPLATES_FOLDER']]:
     Path(folder).mkdir(exist_ok=True)
 
+# ============================================
+# LOGS
+# ============================================
+class LogThrottle(logging.Filter):
+    """Limite de débit globale (limite Railway) et échantillonnage des messages répétitifs:
+    au plus repeat_limit lignes par gabarit de message (ex: "🚀 Job %s en file") et par fenêtre.
+    Les WARNING ne sont jamais échantillonnés, les ERROR jamais supprimés. Compteurs protégés par un verrou."""
+    REPORT_INTERVAL = 5.0
+
+    def __init__(self, max_per_second, repeat_limit, repeat_window=10.0):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self.repeat_limit = repeat_limit
+        self.repeat_window = repeat_window
+        self._lock = threading.Lock()
+        self._second = 0
+        self._emitted = 0
+        self._window_start = time.monotonic()
+        self._repeats = {}
+        self._pending = 0
+        self._last_report = time.monotonic()
+        self.dropped = {'rate': 0, 'sampled': 0, 'queue_full': 0}
+
+    def filter(self, record):
+        now = time.monotonic()
+        with self._lock:
+            if self.repeat_limit and record.levelno < logging.WARNING:
+                if now - self._window_start > self.repeat_window:
+                    self._window_start = now
+                    self._repeats.clear()
+                seen = self._repeats.get(record.msg, 0)
+                self._repeats[record.msg] = seen + 1
+                if seen >= self.repeat_limit:
+                    self.dropped['sampled'] += 1
+                    self._pending += 1
+                    return False
+            second = int(now)
+            if second != self._second:
+                self._second = second
+                self._emitted = 0
+            if self._emitted >= self.max_per_second and record.levelno < logging.ERROR:
+                self.dropped['rate'] += 1
+                self._pending += 1
+                return False
+            self._emitted += 1
+            return True
+
+    def count_drop(self, reason):
+        with self._lock:
+            self.dropped[reason] += 1
+            self._pending += 1
+
+    def take_report(self):
+        """Nombre de lignes supprimées depuis le dernier rapport (toutes les 5 s au plus), sinon 0"""
+        now = time.monotonic()
+        with self._lock:
+            if not self._pending or now - self._last_report < self.REPORT_INTERVAL:
+                return 0
+            pending, self._pending = self._pending, 0
+            self._last_report = now
+            return pending
+
+    def drop_counts(self):
+        with self._lock:
+            return dict(self.dropped)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Dépose les lignes dans une file bornée; un thread (QueueListener) les écrit sur stderr.
+    Les threads de requête n'attendent jamais l'écriture: file pleine = ligne supprimée et comptée."""
+    def __init__(self, log_queue, throttle, target):
+        super().__init__(log_queue)
+        self.throttle = throttle
+        self.target = target
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self):
+        # Le thread d'écriture ne survit pas au fork des workers gunicorn
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._listener = logging.handlers.QueueListener(self.queue, self.target)
+                self._listener.start()
+                atexit.register(self._listener.stop)  # écrit les lignes encore en file à l'arrêt
+                self._pid = os.getpid()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.throttle.count_drop('queue_full')
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+        dropped = self.throttle.take_report()
+        if dropped:
+            self.enqueue(logging.makeLogRecord({
+                'name': record.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f"⚠️ {dropped} logs supprimés (limite de débit / messages répétés)"
+            }))
+
+def setup_logging():
+    """Logger 'duaa': niveaux, formatage paresseux (%s), écriture asynchrone sur stderr"""
+    throttle = LogThrottle(app.config['LOG_RATE_LIMIT'], app.config['LOG_REPEAT_LIMIT'])
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(logging.Formatter('%(message)s'))
+    handler = NonBlockingQueueHandler(queue.Queue(app.config['LOG_QUEUE_SIZE']), throttle, stream)
+    handler.addFilter(throttle)
+    
+    log = logging.getLogger('duaa')
+    log.setLevel(app.config['LOG_LEVEL'])
+    log.handlers = [handler]
+    log.propagate = False
+    return log, throttle
+
+logger, log_throttle = setup_logging()
+
 # Configuration par défaut
 DEFAULT_CONFIG = {
     # Format & Dimensions
@@ -85,9 +271,15 @@ DEFAULT_CONFIG = {
     "text_align": "center",  # left, center, right
     "line_spacing": 1.5,
     "max_width_percent": 85,  # % de la largeur pour le texte (gère les sauts de ligne auto)
+    "auto_fit": False,  # Choisir automatiquement la plus grande taille qui tient dans le cadre
+    "max_height_percent": 80,  # % de la hauteur pour le bloc de texte (auto_fit)
+    "min_font_size": 24,  # Bornes de la recherche auto_fit
+    "max_font_size": 160,
+    "text_wrap": "greedy",  # greedy (remplit chaque ligne), balanced (lignes de longueurs équilibrées)
     
     # Style
     "background_color": "#1a472a",  # Vert islamique par défaut
+    "background_gradient": None,  # {"type": "vertical|horizontal|diagonal|radial", "colors": [...], "stops": [...]}
     "background_image": None,  # URL ou chemin
     "background_blur": 0,  # 0-10
     "background_overlay": True,  # Overlay sombre sur l'image
@@ -97,6 +289,7 @@ DEFAULT_CONFIG = {
     "text_shadow": True,
     "shadow_color": "#000000",
     "shadow_offset": (3, 3),
+    "shadow_blur": 0,  # 0 = ombre nette, >0 = ombre douce (rayon du flou)
     "text_outline": False,
     "outline_width": 2,
     "outline_color": "#000000",
@@ -119,7 +312,11 @@ DEFAULT_CONFIG = {
     
     # Qualité
     "quality": 95,
-    "format_output": "PNG"  # PNG, JPEG
+    "format_output": "PNG",  # PNG, JPEG, WEBP, AVIF
+    "encoder_profile": "balanced",  # fast, balanced, small (compromis CPU / poids du fichier)
+    "png_palette": 0,  # >0 = PNG en palette de N couleurs (fonds unis ou dégradés simples)
+    "jpeg_subsampling": None,  # None (4:2:0), "4:4:4" (couleurs du texte plus nettes), "4:2:2", "4:2:0"
+    "lossless": False  # WEBP/AVIF sans perte
 }
 
 # Formats prédéfinis
@@ -134,11 +331,508 @@ PRESET_FORMATS = {
     "custom": {"width": 1080, "height": 1080}
 }
 
-jobs = {}
+# Priorités des jobs (plus petit = traité en premier)
+JOB_PRIORITIES = {'high': 0, 'normal': 5, 'low': 9}
+
+# ============================================
+# MÉTRIQUES
+# ============================================
+# Bornes des histogrammes de durée (secondes, convention Prometheus)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """Histogramme à bornes fixes (compteur par borne, somme et nombre d'observations)"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # dernière case: au-delà de la plus grande borne (+Inf)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Quantile q estimé par interpolation linéaire dans son bucket (comme histogram_quantile)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+class Metrics:
+    """Durées par étape (téléchargement, décodage, flou, shaping, dessin, encodage...) agrégées
+    en histogrammes, et recopiées dans le dict `timings` du job en cours (par thread)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._histograms = {}  # (métrique, ((label, valeur), ...)) -> Histogram
+
+    def observe(self, metric, labels, seconds):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def collect(self, timings):
+        """Les étapes exécutées dans ce thread s'ajoutent à timings (<étape>_ms) et aux dicts des
+        collectes englobantes (un rendu dans un batch compte aussi pour l'élément); None = inchangé"""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        if timings is not None:
+            stack.append(timings)
+        try:
+            yield timings
+        finally:
+            if timings is not None:
+                stack.pop()
+
+    @contextmanager
+    def stage(self, name):
+        """Chronomètre une étape du rendu; le dict produit reçoit sa durée ('ms') à la sortie"""
+        span = {}
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            elapsed = time.perf_counter() - started
+            span['ms'] = round(elapsed * 1000, 1)
+            self.observe('duaa_stage_duration_seconds', {'stage': name}, elapsed)
+            self.add(f"{name}_ms", elapsed * 1000)
+
+    def add(self, key, value):
+        """Ajoute une valeur aux dicts timings en cours de collecte dans ce thread (s'il y en a)"""
+        seen = set()
+        for timings in getattr(self._local, 'stack', ()):
+            if id(timings) not in seen:
+                seen.add(id(timings))
+                timings[key] = round(timings.get(key, 0) + value, 1)
+
+    def snapshot(self):
+        """Copie des histogrammes: [(métrique, labels, buckets, counts, sum, count)]"""
+        with self._lock:
+            return [(metric, labels, h.buckets, list(h.counts), h.sum, h.count)
+                    for (metric, labels), h in sorted(self._histograms.items())]
+
+    def summary(self):
+        """Nombre, moyenne et p50/p95 (ms) par étape, pour /api/health"""
+        with self._lock:
+            return {
+                dict(labels)['stage']: {
+                    'count': h.count,
+                    'avg_ms': round(h.sum / h.count * 1000, 1),
+                    'p50_ms': round(h.quantile(0.5) * 1000, 1),
+                    'p95_ms': round(h.quantile(0.95) * 1000, 1)
+                }
+                for (metric, labels), h in sorted(self._histograms.items())
+                if metric == 'duaa_stage_duration_seconds' and h.count
+            }
+
+metrics = Metrics()
+
+# ============================================
+# STOCKAGE DES JOBS
+# ============================================
+class JobStore:
+    """Interface de stockage de l'état des jobs (partagé entre workers gunicorn)"""
+    def create(self, job):
+        raise NotImplementedError
+
+    def get(self, job_id):
+        raise NotImplementedError
+
+    def update(self, job_id, **fields):
+        raise NotImplementedError
+
+    def delete(self, job_id):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def evict(self, max_age_seconds, max_records):
+        """Supprime les jobs les moins récemment mis à jour (trop vieux ou au-delà du nombre max)
+        Retourne le nombre de jobs supprimés"""
+        raise NotImplementedError
+
+class MemoryJobStore(JobStore):
+    """Jobs en mémoire du processus (un seul worker)"""
+    def __init__(self):
+        self._jobs = OrderedDict()  # id -> (job, dernière mise à jour), du plus ancien au plus récent
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job['id']] = (dict(job), time.time())
+            self._jobs.move_to_end(job['id'])
+
+    def get(self, job_id):
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            return dict(entry[0]) if entry is not None else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                job = self._jobs[job_id][0]
+                job.update(fields)
+                self._jobs[job_id] = (job, time.time())
+                self._jobs.move_to_end(job_id)
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def count(self):
+        return len(self._jobs)
+
+    def evict(self, max_age_seconds, max_records):
+        # Le plus ancien est toujours en tête: chaque suppression est en O(1)
+        limit = time.time() - max_age_seconds
+        removed = 0
+        with self._lock:
+            while self._jobs:
+                _, (_, updated_at) = next(iter(self._jobs.items()))
+                if updated_at >= limit and len(self._jobs) <= max_records:
+                    break
+                self._jobs.popitem(last=False)
+                removed += 1
+        return removed
+
+class SQLiteJobStore(JobStore):
+    """Jobs dans un fichier SQLite en mode WAL, partagé par tous les workers de la machine"""
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)")
+
+    def _connect(self):
+        # Une connexion par thread et par processus (les connexions ne survivent pas au fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, job):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO jobs (id, data, updated_at) VALUES (?, ?, ?)",
+            (job['id'], json.dumps(job), time.time())
+        )
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id, **fields):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row:
+                job = json.loads(row[0])
+                job.update(fields)
+                conn.execute("UPDATE jobs SET data = ?, updated_at = ? WHERE id = ?",
+                             (json.dumps(job), time.time(), job_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, job_id):
+        self._connect().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def evict(self, max_age_seconds, max_records):
+        # L'index sur updated_at évite de parcourir toute la table
+        conn = self._connect()
+        removed = conn.execute("DELETE FROM jobs WHERE updated_at < ?",
+                               (time.time() - max_age_seconds,)).rowcount
+        excess = self.count() - max_records
+        if excess > 0:
+            removed += conn.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs ORDER BY updated_at LIMIT ?)", (excess,)
+            ).rowcount
+        return removed
+
+class RedisJobStore(JobStore):
+    """Jobs dans Redis (ou compatible), pour plusieurs machines - nécessite le paquet redis
+    Chaque job expire ttl secondes après sa dernière mise à jour (expiration native de Redis)"""
+    def __init__(self, url, prefix='duaa:job:', ttl=None):
+        import redis  # dépendance optionnelle
+        self._redis = redis.Redis.from_url(url)
+        self._watch_error = redis.WatchError
+        self.prefix = prefix
+        self.ttl = int(ttl) if ttl else None
+
+    def create(self, job):
+        self._redis.set(self.prefix + job['id'], json.dumps(job), ex=self.ttl)
+
+    def get(self, job_id):
+        data = self._redis.get(self.prefix + job_id)
+        return json.loads(data) if data else None
+
+    def update(self, job_id, **fields):
+        key = self.prefix + job_id
+        with self._redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    data = pipe.get(key)
+                    if not data:
+                        pipe.unwatch()
+                        return
+                    job = json.loads(data)
+                    job.update(fields)
+                    pipe.multi()
+                    pipe.set(key, json.dumps(job), ex=self.ttl)
+                    pipe.execute()
+                    return
+                except self._watch_error:
+                    continue
+
+    def delete(self, job_id):
+        self._redis.delete(self.prefix + job_id)
+
+    def count(self):
+        return sum(1 for _ in self._redis.scan_iter(match=self.prefix + '*', count=500))
+
+    def evict(self, max_age_seconds, max_records):
+        # Redis supprime lui-même les jobs expirés; pas de nombre max (ce serait un parcours complet)
+        return 0
+
+def create_job_store():
+    """Instancie le stockage des jobs selon JOB_STORE"""
+    backend = app.config['JOB_STORE']
+    if backend == 'memory':
+        return MemoryJobStore()
+    if backend == 'redis':
+        return RedisJobStore(app.config['REDIS_URL'], ttl=app.config['JOB_TTL_HOURS'] * 3600)
+    return SQLiteJobStore(app.config['JOB_STORE_PATH'])
+
+job_store = create_job_store()
+
+# ============================================
+# CACHES
+# ============================================
+class LRUCache:
+    """Cache LRU borné (en entrées et optionnellement en octets), thread-safe, avec compteurs hits/misses"""
+    def __init__(self, maxsize=128, max_bytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self._sizes[key]
+            self._data[key] = value
+            self._sizes[key] = size
+            self.bytes += size
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize or (
+                    self.max_bytes is not None and self.bytes > self.max_bytes and len(self._data) > 1):
+                evicted, _ = self._data.popitem(last=False)
+                self.bytes -= self._sizes.pop(evicted)
+                self.evictions += 1
+
+    def get_or_create(self, key, factory):
+        """Retourne la valeur en cache ou la calcule (hors verrou) puis la stocke"""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        value = factory()
+        self.put(key, value)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self.bytes -= self._sizes.pop(key)
+            return self._data.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        stats = {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
+        if self.max_bytes is not None:
+            stats['bytes'] = self.bytes
+            stats['max_bytes'] = self.max_bytes
+        return stats
+
+class FontRegistry:
+    """Registre des polices: nom résolu en chemin une seule fois, FreeTypeFont gardé par taille"""
+    def __init__(self, maxsize=32):
+        self.fonts = LRUCache(maxsize)
+        self._paths = {}
+        self._digests = {}
+        self.bundled = []  # polices de fonts/ validées au démarrage
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def candidates(font_path):
+        """Emplacements possibles d'une police, dans l'ordre de recherche"""
+        if Path(font_path).is_absolute():
+            yield Path(font_path)
+        yield Path(app.config['FONTS_FOLDER']) / font_path  # dossier fonts/ du projet
+        yield Path(font_path)  # répertoire courant (pour Railway)
+        yield Path(__file__).parent / 'fonts' / font_path  # fonts/ relatif au script
+        # Polices système
+        yield Path(f"/usr/share/fonts/truetype/{font_path}")
+        yield Path(f"/usr/share/fonts/{font_path}")
+        yield Path(f"/System/Library/Fonts/{font_path}")
+        yield Path(f"C:/Windows/Fonts/{font_path}")
+
+    def resolve(self, font_path):
+        """Résout un nom de police en chemin (mis en cache uniquement si trouvé)"""
+        with self._lock:
+            if font_path in self._paths:
+                return self._paths[font_path]
+        for candidate in self.candidates(font_path):
+            if candidate.exists():
+                resolved = str(candidate.resolve())
+                logger.info("✅ Police trouvée: %s", candidate)
+                with self._lock:
+                    self._paths[font_path] = resolved
+                return resolved
+        return None
+
+    def get(self, font_path, size):
+        """Retourne la police chargée pour (chemin résolu, taille) ou None si introuvable"""
+        resolved = self.resolve(font_path)
+        if resolved is None:
+            return None
+        return self.fonts.get_or_create((resolved, size), lambda: ImageFont.truetype(resolved, size))
+
+    @staticmethod
+    def covers_arabic(font):
+        """Vrai si la police a un glyphe pour ب (sinon elle dessine le glyphe manquant)"""
+        glyph = font.getmask('\u0628')
+        missing = font.getmask('\U0010FFFD')
+        return glyph.size != missing.size or glyph.getbbox() != missing.getbbox()
+
+    def validate(self, folder):
+        """Vérifie chaque police du dossier (lisible par FreeType et couvrant l'arabe)
+        Retourne (noms valides, {nom: erreur})"""
+        valid, invalid = [], {}
+        for font_file in sorted(Path(folder).glob('*')):
+            if font_file.suffix.lower() not in ('.ttf', '.otf'):
+                continue
+            try:
+                if not self.covers_arabic(ImageFont.truetype(str(font_file), 24)):
+                    raise ValueError("aucun glyphe arabe")
+                valid.append(font_file.name)
+            except Exception as e:
+                invalid[font_file.name] = str(e)
+                logger.warning("⚠️ Police %s inutilisable: %s", font_file.name, e)
+        with self._lock:
+            self.bundled = valid
+        return valid, invalid
+
+    def fallback(self, preferred=None):
+        """Police du projet utilisée quand la police demandée est introuvable (sans réseau)"""
+        if preferred in self.bundled:
+            return preferred
+        return self.bundled[0] if self.bundled else None
+
+    def preload(self, folder, sizes, names=None):
+        """Précharge les polices d'un dossier (ou seulement names) aux tailles données"""
+        loaded = 0
+        for font_file in sorted(Path(folder).glob('*')):
+            if font_file.suffix.lower() not in ('.ttf', '.otf'):
+                continue
+            if names is not None and font_file.name not in names:
+                continue
+            for size in sizes:
+                try:
+                    if self.get(font_file.name, size) is not None:
+                        loaded += 1
+                except Exception as e:
+                    logger.warning("⚠️ Préchargement police %s échoué: %s", font_file.name, e)
+                    break
+        return loaded
+
+    def digest(self, font_path):
+        """Empreinte SHA-256 du fichier de police (calculée une fois par chemin)"""
+        resolved = self.resolve(font_path)
+        if resolved is None:
+            return None
+        with self._lock:
+            if resolved in self._digests:
+                return self._digests[resolved]
+        with open(resolved, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with self._lock:
+            self._digests[resolved] = digest
+        return digest
+
+    def stats(self):
+        stats = self.fonts.stats()
+        stats['resolved_names'] = len(self._paths)
+        return stats
+
+font_registry = FontRegistry(maxsize=app.config['FONT_CACHE_SIZE'])
 
 def sanitize_filename(filename):
     """Nettoie un nom de fichier"""
-    if filename.endswith(('.png', '.jpg', '.jpeg')):
+    if filename.endswith(('.png', '.jpg', '.jpeg', '.webp', '.avif')):
         filename = filename.rsplit('.', 1)[0]
     
     filename = filename.replace(' ', '_')
@@ -148,6 +842,10 @@ def sanitize_filename(filename):
     if len(filename) > 100:
         filename = filename[:100]
     
+    # ca-* est réservé au cache de rendus (outputs/ca-<clé>): un nom client ne doit jamais l'écraser
+    if filename.lower().startswith('ca-'):
+        filename = f"out-{filename}"
+    
     return filename
 
 def clean_arabic_text(text):
@@ -157,70 +855,209 @@ def clean_arabic_text(text):
     text = text.strip()
     return text
 
+class CachedLigaturesReshaper(ArabicReshaper):
+    """ArabicReshaper dont la regex des ligatures n'est compilée qu'une fois
+    (arabic-reshaper 3.0.0 la reconstruit à chaque appel de reshape())"""
+    @property
+    def _ligatures_re(self):
+        if '_compiled_ligatures_re' not in self.__dict__:
+            self._compiled_ligatures_re = ArabicReshaper._ligatures_re.fget(self)
+        return self._compiled_ligatures_re
+
+# Reshaper partagé: les tables de ligatures ne sont parsées qu'une fois
+shared_reshaper = CachedLigaturesReshaper(configuration={
+    'delete_harakat': False,
+    'support_ligatures': True,
+})
+shaping_cache = LRUCache(maxsize=app.config['SHAPING_CACHE_SIZE'])
+
+def _shape_text(text):
+    with metrics.stage('shaping'):
+        return get_display(shared_reshaper.reshape(text))
+
 def reshape_arabic_text(text):
-    """Reshape le texte arabe pour l'affichage correct"""
-    reshaper = ArabicReshaper(configuration={
-        'delete_harakat': False,
-        'support_ligatures': True,
-    })
-    reshaped = reshaper.reshape(text)
-    bidi_text = get_display(reshaped)
-    return bidi_text
+    """Reshape le texte arabe pour l'affichage correct (résultat mis en cache)"""
+    return shaping_cache.get_or_create(text, lambda: _shape_text(text))
+
+# ============================================
+# TÉLÉCHARGEMENTS
+# ============================================
+# Au-delà de MAX_IMAGE_PIXELS, Pillow refuse d'ouvrir l'image au lieu de simplement avertir
+Image.MAX_IMAGE_PIXELS = app.config['MAX_IMAGE_PIXELS']
+warnings.simplefilter('error', Image.DecompressionBombWarning)
+
+class DownloadError(Exception):
+    """Téléchargement refusé ou échoué (taille, hôte saturé, HTTP)"""
+
+class CappedRetry(Retry):
+    """Retry dont l'attente demandée par Retry-After est plafonnée: un 429 avec Retry-After: 3600
+    bloquerait sinon un thread de rendu (et la place de l'hôte) pendant des heures"""
+    def __init__(self, *args, max_retry_after=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_retry_after = max_retry_after
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.max_retry_after = self.max_retry_after
+        return retry
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is not None and self.max_retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return retry_after
+
+class Downloader:
+    """Téléchargements HTTP partagés: pool de connexions keep-alive (une session par processus),
+    nouvelles tentatives avec attente exponentielle, limite de téléchargements simultanés
+    par hôte et taille max vérifiée pendant la lecture"""
+    CHUNK_SIZE = 64 * 1024
+    HEADERS = {
+        # Headers pour Cloudinary et autres CDN
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    }
+
+    def __init__(self, max_bytes, timeout, retries, backoff, per_host):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._session = None
+        self._pid = None
+        self.requests = 0
+        self.bytes = 0
+        self.too_large = 0
+        self.host_busy = 0
+        self.errors = 0
+
+    def session(self):
+        """Session du processus courant (les connexions ne survivent pas au fork des workers gunicorn)"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    session = requests.Session()
+                    session.headers.update(self.HEADERS)
+                    retry = CappedRetry(
+                        total=self.retries,
+                        backoff_factor=self.backoff,
+                        status_forcelist=(429, 500, 502, 503, 504),
+                        allowed_methods=('GET', 'HEAD'),
+                        respect_retry_after_header=True,
+                        max_retry_after=self.timeout,
+                        raise_on_status=False
+                    )
+                    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max(self.per_host, 4), max_retries=retry)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+                    self._hosts = {}
+                    self._pid = os.getpid()
+        return self._session
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def fetch(self, url, headers=None, max_bytes=None):
+        """GET en streaming; retourne {'status', 'data', 'headers'} (data vide pour un 304)
+        Lève DownloadError si l'hôte est saturé, si la réponse dépasse max_bytes ou en cas d'erreur HTTP"""
+        session = self.session()
+        max_bytes = max_bytes or self.max_bytes
+        slot = self._host_slot(url)
+        if not slot.acquire(timeout=self.timeout):
+            self.host_busy += 1
+            raise DownloadError(f"Trop de téléchargements simultanés vers {urlsplit(url).netloc}")
+        try:
+            self.requests += 1
+            try:
+                with metrics.stage('download'), \
+                        session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                    if response.status_code == 304:
+                        return {'status': 304, 'data': b'', 'headers': response.headers}
+                    response.raise_for_status()
+                    
+                    # Refus immédiat si la taille annoncée dépasse la limite, puis vérification pendant la lecture
+                    # (la limite porte sur les octets décompressés: pas de gzip bomb)
+                    announced = response.headers.get('Content-Length')
+                    if announced and announced.isdigit() and int(announced) > max_bytes:
+                        self.too_large += 1
+                        raise DownloadError(f"Fichier trop volumineux ({int(announced) / 1024 / 1024:.1f} MB)")
+                    data = bytearray()
+                    for chunk in response.iter_content(self.CHUNK_SIZE):
+                        data += chunk
+                        if len(data) > max_bytes:
+                            self.too_large += 1
+                            raise DownloadError(f"Fichier trop volumineux (> {max_bytes / 1024 / 1024:.1f} MB)")
+                    self.bytes += len(data)
+                    return {'status': response.status_code, 'data': bytes(data), 'headers': response.headers}
+            except requests.exceptions.RequestException as e:
+                self.errors += 1
+                raise DownloadError(str(e)) from e
+        finally:
+            slot.release()
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'bytes': self.bytes,
+            'too_large': self.too_large,
+            'host_busy': self.host_busy,
+            'errors': self.errors,
+            'max_bytes': self.max_bytes,
+            'per_host': self.per_host,
+            'hosts': len(self._hosts)
+        }
+
+downloader = Downloader(
+    max_bytes=int(app.config['DOWNLOAD_MAX_MB'] * 1024 * 1024),
+    timeout=app.config['DOWNLOAD_TIMEOUT'],
+    retries=app.config['DOWNLOAD_RETRIES'],
+    backoff=app.config['DOWNLOAD_BACKOFF'],
+    per_host=app.config['DOWNLOAD_PER_HOST']
+)
 
-def download_file(url, destination):
-    """Télécharge un fichier depuis une URL avec logs détaillés"""
+def download_bytes(url, extra_headers=None, max_bytes=None):
+    """Télécharge une URL en mémoire avec logs détaillés
+    Retourne {'status' (200 ou 304), 'data', 'headers'} ou None en cas d'échec"""
     try:
-        print(f"📥 Téléchargement de: {url}")
-        print(f"📁 Destination: {destination}")
+        logger.debug("📥 Téléchargement de: %s", url)
         
         # Vérifier que l'URL est valide
         if not url or not url.startswith('http'):
-            print(f"❌ URL invalide: {url}")
-            return False
-        
-        # Headers pour Cloudinary et autres CDN
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
+            logger.error("❌ URL invalide: %s", url)
+            return None
         
-        response = requests.get(url, stream=True, timeout=30, headers=headers)
-        response.raise_for_status()
+        result = downloader.fetch(url, extra_headers, max_bytes)
+        if result['status'] == 304:
+            logger.debug("♻️ Non modifié: %s", url)
+            return result
         
         # Vérifier le Content-Type
-        content_type = response.headers.get('Content-Type', '')
-        print(f"📋 Content-Type: {content_type}")
-        
-        # Vérifier la taille
-        content_length = response.headers.get('Content-Length')
-        if content_length:
-            size_mb = int(content_length) / (1024 * 1024)
-            print(f"📦 Taille: {size_mb:.2f} MB")
-        
-        with open(destination, 'wb') as f:
-            total_size = 0
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-                total_size += len(chunk)
-        
-        print(f"✅ Téléchargé: {total_size / 1024:.2f} KB")
-        
-        # Vérifier que le fichier existe et n'est pas vide
-        if Path(destination).exists() and Path(destination).stat().st_size > 0:
-            print(f"✅ Fichier créé: {destination}")
-            return True
-        else:
-            print(f"❌ Fichier vide ou inexistant")
-            return False
+        content_type = result['headers'].get('Content-Type', '')
+        logger.debug("📋 Content-Type: %s", content_type)
+        
+        if not result['data']:
+            logger.error("❌ Réponse vide: %s", url)
+            return None
+        
+        logger.info("✅ Téléchargé: %.2f KB", len(result['data']) / 1024)
+        return result
             
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Erreur HTTP téléchargement {url}: {e}")
-        return False
+    except DownloadError as e:
+        logger.error("❌ Erreur téléchargement %s: %s", url, e)
+        return None
     except Exception as e:
-        print(f"❌ Erreur générale téléchargement {url}: {e}")
-        return False
+        logger.error("❌ Erreur générale téléchargement %s: %s", url, e)
+        return None
 
 def download_fallback_font():
-    """Télécharge une police arabe de secours si aucune police n'est trouvée"""
+    """Télécharge une police arabe de secours (au démarrage seulement, jamais pendant un rendu)"""
     fallback_fonts = [
         {
             "name": "Amiri-Regular.ttf",
@@ -239,233 +1076,622 @@ def download_fallback_font():
         font_path = fonts_folder / font_info["name"]
         if not font_path.exists():
             try:
-                print(f"📥 Téléchargement police de secours: {font_info['name']}")
-                response = requests.get(font_info["url"], timeout=30)
-                response.raise_for_status()
+                logger.info("📥 Téléchargement police de secours: %s", font_info['name'])
+                data = downloader.fetch(font_info["url"])['data']
                 
                 with open(font_path, 'wb') as f:
-                    f.write(response.content)
+                    f.write(data)
                 
-                print(f"✅ Police téléchargée: {font_path}")
+                logger.info("✅ Police téléchargée: %s", font_path)
                 return str(font_path)
             except Exception as e:
-                print(f"⚠️ Échec téléchargement {font_info['name']}: {e}")
+                logger.warning("⚠️ Échec téléchargement %s: %s", font_info['name'], e)
                 continue
     
     return None
 
 def get_font(font_path, size):
-    """Charge une police TrueType"""
+    """Charge une police TrueType (via le registre des polices)"""
     try:
-        # Si le chemin est absolu et existe, l'utiliser directement
-        if Path(font_path).is_absolute() and Path(font_path).exists():
-            return ImageFont.truetype(str(font_path), size)
-        
-        # Chercher dans le dossier fonts/ du projet
-        project_font = Path(app.config['FONTS_FOLDER']) / font_path
-        if project_font.exists():
-            print(f"✅ Police trouvée: {project_font}")
-            return ImageFont.truetype(str(project_font), size)
-        
-        # Chercher dans le répertoire courant (pour Railway)
-        current_dir_font = Path(font_path)
-        if current_dir_font.exists():
-            print(f"✅ Police trouvée: {current_dir_font}")
-            return ImageFont.truetype(str(current_dir_font), size)
-        
-        # Chercher dans fonts/ relatif au script
-        script_dir = Path(__file__).parent
-        script_font = script_dir / 'fonts' / font_path
-        if script_font.exists():
-            print(f"✅ Police trouvée: {script_font}")
-            return ImageFont.truetype(str(script_font), size)
-        
-        # Chercher dans les polices système
-        system_font_paths = [
-            f"/usr/share/fonts/truetype/{font_path}",
-            f"/usr/share/fonts/{font_path}",
-            f"/System/Library/Fonts/{font_path}",
-            f"C:/Windows/Fonts/{font_path}"
-        ]
-        
-        for sys_path in system_font_paths:
-            if Path(sys_path).exists():
-                print(f"✅ Police système trouvée: {sys_path}")
-                return ImageFont.truetype(sys_path, size)
-        
-        # ⚠️ CRITIQUE: Police arabe non trouvée - télécharger une police de secours
-        print(f"⚠️ Police {font_path} introuvable!")
-        print("📥 Tentative de téléchargement d'une police arabe de secours...")
-        
-        fallback_path = download_fallback_font()
-        if fallback_path and Path(fallback_path).exists():
-            print(f"✅ Utilisation de la police de secours: {fallback_path}")
-            return ImageFont.truetype(fallback_path, size)
+        font = font_registry.get(font_path, size)
+        if font is not None:
+            return font
+        
+        # Police introuvable: police du projet validée au démarrage (pas de téléchargement ici)
+        fallback_name = font_registry.fallback(DEFAULT_CONFIG['font_name'])
+        logger.warning("⚠️ Police %s introuvable, remplacée par %s", font_path, fallback_name)
+        if fallback_name:
+            fallback = font_registry.get(fallback_name, size)
+            if fallback is not None:
+                return fallback
         
         # En dernier recours, utiliser la police par défaut (ne supporte PAS l'arabe)
-        print(f"❌ ERREUR CRITIQUE: Aucune police arabe disponible!")
-        print(f"❌ Ajoutez KFGQPC-Uthman-Taha.ttf dans le dossier fonts/")
+        logger.critical("❌ ERREUR CRITIQUE: Aucune police arabe disponible!")
+        logger.critical("❌ Ajoutez KFGQPC-Uthman-Taha.ttf dans le dossier fonts/")
         return ImageFont.load_default()
         
     except Exception as e:
-        print(f"⚠️ Erreur chargement police {font_path}: {e}")
+        logger.warning("⚠️ Erreur chargement police %s: %s", font_path, e)
         return ImageFont.load_default()
 
-def wrap_text(text, font, max_width):
+word_width_cache = LRUCache(maxsize=app.config['WORD_WIDTH_CACHE_SIZE'])
+
+def _font_key(font):
+    """Identifie une police chargée: (fichier, taille)"""
+    return (getattr(font, 'path', None) or id(font), getattr(font, 'size', 0))
+
+def measure_text(text, font):
+    """Largeur d'affichage du texte reshapé (mesurée une seule fois par police)"""
+    return word_width_cache.get_or_create(
+        (_font_key(font), text),
+        lambda: font.getlength(reshape_arabic_text(text))
+    )
+
+def _greedy_break(widths, space_width, start, max_width):
+    """Fin de la ligne commençant à start: on remplit tant que la largeur cumulée tient"""
+    line_width = widths[start]
+    end = start + 1
+    while end < len(widths) and line_width + space_width + widths[end] <= max_width:
+        line_width += space_width + widths[end]
+        end += 1
+    return end
+
+def _balanced_breaks(widths, space_width, max_width):
+    """Coupures minimisant la somme des carrés des espaces restants (hors dernière ligne)"""
+    n = len(widths)
+    cost = [0.0] * (n + 1)
+    next_break = [n] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        best = None
+        line_width = -space_width
+        for j in range(i + 1, n + 1):
+            line_width += space_width + widths[j - 1]
+            if line_width > max_width and j > i + 1:
+                break
+            slack = 0 if j == n else max(max_width - line_width, 0)
+            total = slack * slack + cost[j]
+            if best is None or total < best:
+                best = total
+                next_break[i] = j
+        cost[i] = best
+    return next_break
+
+def wrap_text(text, font, max_width, mode='greedy'):
     """Découpe le texte en lignes pour respecter la largeur max - Compatible RTL"""
     # Pour l'arabe, on travaille avec le texte AVANT reshape
     # On va découper puis reshaper chaque ligne individuellement
+    # Chaque mot est mesuré une fois (forme reshapée), les largeurs sont cumulées
     words = text.split()
-    lines = []
-    current_line = []
+    if not words:
+        return []
     
-    for word in words:
-        test_line = ' '.join(current_line + [word])
-        bbox = font.getbbox(test_line)
-        width = bbox[2] - bbox[0]
-        
-        if width <= max_width:
-            current_line.append(word)
-        else:
-            if current_line:
-                lines.append(' '.join(current_line))
-            current_line = [word]
+    widths = [measure_text(word, font) for word in words]
+    space_width = measure_text(' ', font)
+    balanced = _balanced_breaks(widths, space_width, max_width) if mode == 'balanced' else None
     
-    if current_line:
-        lines.append(' '.join(current_line))
+    lines = []
+    start = 0
+    while start < len(words):
+        if balanced is not None:
+            end = balanced[start]
+        else:
+            end = _greedy_break(widths, space_width, start, max_width)
+        
+        # Valider la ligne finie sur sa largeur reshapée réelle (crénage, ligatures)
+        while end - start > 1 and measure_text(' '.join(words[start:end]), font) > max_width:
+            end -= 1
+        
+        lines.append(' '.join(words[start:end]))
+        start = end
     
     return lines
 
+gradient_cache = LRUCache(maxsize=app.config['GRADIENT_CACHE_SIZE'])
+
+def _gradient_mask(gradient_type, width, height):
+    """Masque L (0 → 255) du dégradé, calculé en bloc par Pillow puis redimensionné"""
+    if gradient_type == 'vertical':
+        mask = Image.linear_gradient('L')
+    elif gradient_type == 'horizontal':
+        mask = Image.linear_gradient('L').transpose(Image.Transpose.ROTATE_90)
+    elif gradient_type == 'diagonal':
+        vertical = Image.linear_gradient('L')
+        mask = Image.blend(vertical, vertical.transpose(Image.Transpose.ROTATE_90), 0.5)
+    elif gradient_type == 'radial':
+        # Centre à 0, coins à 255
+        mask = Image.radial_gradient('L')
+    else:
+        raise ValueError(f"Type de dégradé inconnu: {gradient_type}")
+    return mask.resize((width, height), Image.Resampling.BILINEAR)
+
+def _gradient_lut(colors, stops):
+    """Table de 3×256 valeurs interpolées entre les arrêts de couleur (pour Image.point)"""
+    bands = ([], [], [])
+    for level in range(256):
+        t = level / 255
+        index = 1
+        while index < len(stops) - 1 and t > stops[index]:
+            index += 1
+        t0, t1 = stops[index - 1], stops[index]
+        ratio = min(max((t - t0) / (t1 - t0), 0.0), 1.0) if t1 > t0 else 1.0
+        for band in range(3):
+            c0, c1 = colors[index - 1][band], colors[index][band]
+            bands[band].append(int(c0 + (c1 - c0) * ratio))
+    return bands[0] + bands[1] + bands[2]
+
+def render_gradient(width, height, spec):
+    """Crée un fond dégradé (multi-arrêts) à partir d'une spec, mis en cache par spec et taille"""
+    gradient_type = spec.get('type', 'vertical')
+    colors = tuple(hex_to_rgb(c) if isinstance(c, str) else tuple(c) for c in spec.get('colors', []))
+    if len(colors) < 2:
+        raise ValueError("Un dégradé nécessite au moins 2 couleurs")
+    stops = spec.get('stops') or [i / (len(colors) - 1) for i in range(len(colors))]
+    if len(stops) != len(colors):
+        raise ValueError("stops doit avoir autant d'éléments que colors")
+    stops = tuple(float(stop) for stop in stops)
+    
+    def build():
+        mask = _gradient_mask(gradient_type, width, height)
+        return Image.merge('RGB', (mask, mask, mask)).point(_gradient_lut(colors, stops))
+    
+    base = gradient_cache.get_or_create((gradient_type, colors, stops, width, height), build)
+    return base.copy()
+
 def create_gradient_background(width, height, color1, color2, direction='vertical'):
     """Crée un fond avec gradient"""
-    base = Image.new('RGB', (width, height), color1)
-    draw = ImageDraw.Draw(base)
-    
-    if direction == 'vertical':
-        for y in range(height):
-            r = int(color1[0] + (color2[0] - color1[0]) * y / height)
-            g = int(color1[1] + (color2[1] - color1[1]) * y / height)
-            b = int(color1[2] + (color2[2] - color1[2]) * y / height)
-            draw.line([(0, y), (width, y)], fill=(r, g, b))
-    else:  # horizontal
-        for x in range(width):
-            r = int(color1[0] + (color2[0] - color1[0]) * x / width)
-            g = int(color1[1] + (color2[1] - color1[1]) * x / width)
-            b = int(color1[2] + (color2[2] - color1[2]) * x / width)
-            draw.line([(x, 0), (x, height)], fill=(r, g, b))
-    
-    return base
+    return render_gradient(width, height, {'type': direction, 'colors': [color1, color2]})
+
+def canvas_size(config):
+    """Dimensions (largeur, hauteur) du canevas pour une config"""
+    if config['format'] in PRESET_FORMATS:
+        return PRESET_FORMATS[config['format']]['width'], PRESET_FORMATS[config['format']]['height']
+    return config['width'], config['height']
+
+def percentile(sorted_values, q):
+    """Percentile q (0-1) d'une liste déjà triée (0 si vide)"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
 
 def hex_to_rgb(hex_color):
     """Convertit couleur hex en RGB"""
     hex_color = hex_color.lstrip('#')
     return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
-def generate_duaa_image(duaa_text, config, output_path):
-    """Génère l'image de dou'a"""
-    try:
-        # Dimensions
-        if config['format'] in PRESET_FORMATS:
-            width = PRESET_FORMATS[config['format']]['width']
-            height = PRESET_FORMATS[config['format']]['height']
-        else:
-            width = config['width']
-            height = config['height']
+# ============================================
+# CACHE DES FONDS
+# ============================================
+class BackgroundSourceCache:
+    """Octets bruts des fonds distants par URL (mémoire + disque), revalidés par ETag/Last-Modified"""
+    def __init__(self, folder, memory_bytes, disk_bytes, revalidate_seconds):
+        self.folder = Path(folder)
+        self.disk_bytes = disk_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.memory = LRUCache(maxsize=256, max_bytes=memory_bytes, sizeof=lambda entry: len(entry['data']))
+        self._disk_lock = threading.Lock()
+        self.downloads = 0
+        self.revalidations = 0
+        self.not_modified = 0
+        self.disk_hits = 0
+        self.disk_evictions = 0
+
+    def _paths(self, url):
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return self.folder / f"{name}.bin", self.folder / f"{name}.json"
+
+    def _load_disk(self, url):
+        data_path, meta_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text())
+            data = data_path.read_bytes()
+        except (OSError, ValueError):
+            return None
+        if hashlib.sha256(data).hexdigest() != meta.get('digest'):
+            return None
+        os.utime(data_path)  # LRU disque basé sur mtime
+        meta['data'] = data
+        return meta
+
+    def _store_disk(self, url, entry):
+        data_path, meta_path = self._paths(url)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            tmp_data = data_path.with_suffix(suffix)
+            tmp_data.write_bytes(entry['data'])
+            os.replace(tmp_data, data_path)
+            self._store_meta(url, entry)
+        except OSError as e:
+            logger.warning("⚠️ Écriture cache fond échouée: %s", e)
+            return
+        self._enforce_disk_quota()
+
+    def _store_meta(self, url, entry):
+        _, meta_path = self._paths(url)
+        meta = {k: v for k, v in entry.items() if k != 'data'}
+        tmp_meta = meta_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_meta.write_text(json.dumps(meta))
+        os.replace(tmp_meta, meta_path)
+
+    def _refresh_disk(self, url, entry):
+        """Après un 304: seules les métadonnées (checked_at) changent, la taille disque non plus"""
+        data_path, _ = self._paths(url)
+        try:
+            os.utime(data_path)  # LRU disque basé sur mtime
+            self._store_meta(url, entry)
+        except FileNotFoundError:
+            self._store_disk(url, entry)  # Copie disque évincée entre-temps
+        except OSError as e:
+            logger.warning("⚠️ Écriture cache fond échouée: %s", e)
+
+    def _enforce_disk_quota(self):
+        """Supprime les fonds les moins récemment utilisés au-delà du quota disque"""
+        with self._disk_lock:
+            files = []
+            for data_path in self.folder.glob('*.bin'):
+                try:
+                    stat = data_path.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, data_path))
+            total = sum(size for _, size, _ in files)
+            for _, size, data_path in sorted(files):
+                if total <= self.disk_bytes:
+                    break
+                data_path.unlink(missing_ok=True)
+                data_path.with_suffix('.json').unlink(missing_ok=True)
+                total -= size
+                self.disk_evictions += 1
+
+    def get(self, url):
+        """Retourne {'data', 'digest', 'etag', 'last_modified', 'checked_at'} ou None"""
+        entry = self.memory.get(url)
+        if entry is None:
+            entry = self._load_disk(url)
+            if entry is not None:
+                self.disk_hits += 1
+                self.memory.put(url, entry)
         
-        print(f"📐 Dimensions: {width}x{height}")
+        now = time.time()
+        if entry is not None and now - entry['checked_at'] < self.revalidate_seconds:
+            return entry
         
-        # Créer le fond
-        if config['background_image']:
-            print(f"🖼️ Traitement du background: {config['background_image']}")
-            
-            # Image de fond
-            if config['background_image'].startswith('http'):
-                print(f"🌐 Background depuis URL")
-                bg_temp = Path(app.config['TEMP_FOLDER']) / f"bg_{uuid.uuid4()}.jpg"
-                
-                if download_file(config['background_image'], str(bg_temp)):
-                    try:
-                        print(f"📂 Ouverture de l'image téléchargée...")
-                        img = Image.open(bg_temp)
-                        print(f"✅ Image ouverte: {img.size}, mode: {img.mode}")
-                        bg_temp.unlink()  # Supprimer le fichier temporaire
-                    except Exception as e:
-                        print(f"❌ Erreur ouverture image: {e}")
-                        print(f"⚠️ Fallback: couleur de fond")
-                        img = Image.new('RGB', (width, height), hex_to_rgb(config['background_color']))
-                        if bg_temp.exists():
-                            bg_temp.unlink()
-                else:
-                    print(f"❌ Échec téléchargement, utilisation couleur de fond")
-                    img = Image.new('RGB', (width, height), hex_to_rgb(config['background_color']))
-            else:
-                print(f"📁 Background depuis fichier local")
-                bg_path = Path(app.config['BACKGROUNDS_FOLDER']) / config['background_image']
-                if bg_path.exists():
-                    img = Image.open(bg_path)
-                    print(f"✅ Image locale ouverte: {img.size}")
-                else:
-                    print(f"❌ Fichier local introuvable: {bg_path}")
-                    img = Image.new('RGB', (width, height), hex_to_rgb(config['background_color']))
-            
-            # Redimensionner et recadrer
-            print(f"🔄 Conversion en RGB...")
+        # Requête conditionnelle si on a déjà une copie
+        headers = {}
+        if entry is not None:
+            self.revalidations += 1
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        
+        result = download_bytes(url, headers)
+        if result is None or (result['status'] == 304 and entry is None):
+            if entry is not None:
+                logger.warning("⚠️ Revalidation impossible, copie en cache utilisée: %s", url)
+            return entry
+        
+        if result['status'] == 304:
+            self.not_modified += 1
+            entry = dict(entry, checked_at=now)
+            self.memory.put(url, entry)
+            self._refresh_disk(url, entry)
+            return entry
+        
+        self.downloads += 1
+        entry = {
+            'data': result['data'],
+            'digest': hashlib.sha256(result['data']).hexdigest(),
+            'etag': result['headers'].get('ETag'),
+            'last_modified': result['headers'].get('Last-Modified'),
+            'checked_at': now
+        }
+        self.memory.put(url, entry)
+        self._store_disk(url, entry)
+        return entry
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats.update({
+            'downloads': self.downloads,
+            'revalidations': self.revalidations,
+            'not_modified': self.not_modified,
+            'disk_hits': self.disk_hits,
+            'disk_evictions': self.disk_evictions,
+            'disk_max_bytes': self.disk_bytes
+        })
+        return stats
+
+background_sources = BackgroundSourceCache(
+    app.config['BG_CACHE_FOLDER'],
+    memory_bytes=app.config['BG_SOURCE_MEMORY_MB'] * 1024 * 1024,
+    disk_bytes=app.config['BG_SOURCE_DISK_MB'] * 1024 * 1024,
+    revalidate_seconds=app.config['BG_REVALIDATE_SECONDS']
+)
+processed_backgrounds = LRUCache(
+    maxsize=128,
+    max_bytes=app.config['BG_PROCESSED_MEMORY_MB'] * 1024 * 1024,
+    sizeof=lambda img: img.width * img.height * len(img.getbands())
+)
+
+def cover_box(src_width, src_height, width, height):
+    """Zone centrée de l'image source qui couvre exactement le ratio cible"""
+    target_ratio = width / height
+    if src_width / src_height > target_ratio:
+        crop_width = src_height * target_ratio
+        left = (src_width - crop_width) / 2
+        return (left, 0, left + crop_width, src_height)
+    crop_height = src_width / target_ratio
+    top = (src_height - crop_height) / 2
+    return (0, top, src_width, top + crop_height)
+
+def blur_image(img, radius):
+    """Flou gaussien; les grands rayons sont calculés sur une image réduite puis agrandie"""
+    factor = min(4, int(radius // 2)) if radius >= app.config['BLUR_DOWNSCALE_MIN_RADIUS'] else 1
+    if factor <= 1:
+        return img.filter(ImageFilter.GaussianBlur(radius=radius))
+    small = img.reduce(factor)
+    small = small.filter(ImageFilter.GaussianBlur(radius=radius / factor))
+    return small.resize(img.size, Image.Resampling.BICUBIC)
+
+def reduction_factor(src_size, width, height):
+    """Plus grand facteur de réduction entier (1, 2, 4, 8) qui couvre encore la cible"""
+    box = cover_box(src_size[0], src_size[1], width, height)
+    scale = max(width / (box[2] - box[0]), height / (box[3] - box[1]))
+    factor = 1
+    while factor < 8 and scale * factor * 2 <= 1:
+        factor *= 2
+    return factor
+
+def decode_background(img, sizes):
+    """Décode une image de fond une seule fois, à la plus petite échelle JPEG (1/2, 1/4, 1/8)
+    qui couvre encore toutes les tailles cibles"""
+    if img.format == 'JPEG':
+        scale = 0
+        for width, height in sizes:
+            box = cover_box(img.width, img.height, width, height)
+            scale = max(scale, width / (box[2] - box[0]), height / (box[3] - box[1]))
+        img.draft('RGB', (int(img.width * scale) + 1, int(img.height * scale) + 1))
+    
+    if img.mode not in ('RGB', 'L'):
+        return img.convert('RGB')
+    img.load()
+    return img
+
+def finish_background(img, width, height, config):
+    """Recadre (cover), floute et assombrit une image de fond déjà décodée"""
+    logger.debug("📏 Redimensionnement de %s vers %sx%s", img.size, width, height)
+    
+    # Recadrer et redimensionner en une passe: réduction entière puis LANCZOS sur la zone utile
+    with metrics.stage('resize'):
+        img = img.resize((width, height), Image.Resampling.LANCZOS,
+                         box=cover_box(img.width, img.height, width, height), reducing_gap=3.0)
+        if img.mode != 'RGB':
             img = img.convert('RGB')
-            img_ratio = img.width / img.height
-            target_ratio = width / height
-            
-            print(f"📏 Redimensionnement de {img.size} vers {width}x{height}")
-            
-            if img_ratio > target_ratio:
-                new_height = height
-                new_width = int(height * img_ratio)
-            else:
-                new_width = width
-                new_height = int(width / img_ratio)
-            
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Centrer le crop
-            left = (img.width - width) // 2
-            top = (img.height - height) // 2
-            img = img.crop((left, top, left + width, top + height))
-            print(f"✂️ Image recadrée: {img.size}")
+    
+    # Appliquer le blur si demandé
+    if config['background_blur'] > 0:
+        with metrics.stage('blur'):
+            img = blur_image(img, config['background_blur'])
+    
+    # Overlay sombre: mélange direct avec du noir, sans passer par RGBA
+    if config['background_overlay']:
+        with metrics.stage('overlay'):
+            img = Image.blend(img, Image.new('RGB', img.size, (0, 0, 0)), config['overlay_opacity'])
+    
+    return img
+
+def process_background(img, width, height, config):
+    """Recadre (cover), floute et assombrit une image de fond"""
+    return finish_background(decode_background(img, [(width, height)]), width, height, config)
+
+def _load_background_source(source):
+    """Retourne (identifiant du contenu, octets ou chemin) pour une URL ou un fichier de backgrounds/"""
+    if source.startswith('http'):
+        entry = background_sources.get(source)
+        if entry is None:
+            return None, None
+        return entry['digest'], BytesIO(entry['data'])
+    
+    bg_path = Path(app.config['BACKGROUNDS_FOLDER']) / source
+    if not bg_path.exists():
+        logger.error("❌ Fichier local introuvable: %s", bg_path)
+        return None, None
+    stat = bg_path.stat()
+    return f"{bg_path}:{stat.st_mtime_ns}:{stat.st_size}", bg_path
+
+def prepare_backgrounds(config, sizes):
+    """Fonds image prêts à l'emploi pour une ou plusieurs tailles: la source est téléchargée
+    et décodée une seule fois, chaque fond fini est mis en cache"""
+    source = config['background_image']
+    source_id, handle = _load_background_source(source)
+    if source_id is None:
+        return {}
+    
+    backgrounds = {}
+    missing = []
+    for width, height in dict.fromkeys(sizes):
+        key = (source_id, width, height, config['background_blur'],
+               bool(config['background_overlay']), config['overlay_opacity'])
+        cached = processed_backgrounds.get(key)
+        if cached is not None:
+            backgrounds[(width, height)] = cached.copy()
+        else:
+            missing.append((key, width, height))
+    
+    if missing:
+        try:
+            with metrics.stage('decode'):
+                img = Image.open(handle)
+                logger.debug("✅ Image ouverte: %s, mode: %s", img.size, img.mode)
+                decoded = decode_background(img, [(width, height) for _, width, height in missing])
+            # Une réduction entière partagée par facteur, comme le ferait le décodage JPEG en draft
+            reduced = {1: decoded}
+            for key, width, height in missing:
+                factor = reduction_factor(decoded.size, width, height)
+                if factor not in reduced:
+                    with metrics.stage('resize'):
+                        reduced[factor] = decoded.reduce(factor)
+                finished = finish_background(reduced[factor], width, height, config)
+                processed_backgrounds.put(key, finished)
+                backgrounds[(width, height)] = finished.copy()
+        except Exception as e:
+            logger.error("❌ Erreur ouverture image: %s", e)
+    
+    return backgrounds
+
+def prepare_background(config, width, height):
+    """Fond image prêt à l'emploi: téléchargé, décodé, recadré, flouté et assombri une seule fois par source"""
+    return prepare_backgrounds(config, [(width, height)]).get((width, height))
+
+# Masques L des lignes déjà rasterisées: une formule de début ou un footer répété n'est dessiné qu'une fois
+text_masks = LRUCache(maxsize=8192, max_bytes=app.config['TEXT_MASK_CACHE_MB'] * 1024 * 1024,
+                      sizeof=lambda entry: entry[0].width * entry[0].height)
+
+def text_mask(text, font, stroke_width=0):
+    """Masque L du texte reshapé et son décalage par rapport au point d'ancrage,
+    rasterisés une fois par (texte, police, taille, contour)"""
+    def rasterize():
+        # Même rasterisation que draw.text: bitmap et décalage de getmask2 posés par draw_bitmap.
+        # (draw.text sur le masque redessinerait le remplissage par-dessus le contour)
+        bitmap, (left, top) = font.getmask2(text, 'L', stroke_width=stroke_width)
+        mask = Image.new('L', bitmap.size, 0)
+        ImageDraw.Draw(mask).draw.draw_bitmap((0, 0), bitmap, 255)
+        return mask, (left, top)
+    return text_masks.get_or_create((_font_key(font), text, stroke_width), rasterize)
+
+def paste_text(img, xy, text, font, color, stroke_width=0, stroke_color=None):
+    """Même résultat que draw.text(xy, text, ...) mais à partir des masques en cache:
+    contour puis texte, chacun colorisé et collé à travers son masque"""
+    if not isinstance(font, ImageFont.FreeTypeFont):
+        # Police bitmap par défaut (aucune police trouvée): pas de contour, pas de cache
+        ImageDraw.Draw(img).text(xy, text, font=font, fill=color)
+        return
+    layers = [(stroke_width, stroke_color)] if stroke_width else []
+    for width, fill in layers + [(0, color)]:
+        mask, (left, top) = text_mask(text, font, width)
+        if mask.width and mask.height:
+            img.paste(fill, (xy[0] + left, xy[1] + top), mask)
+
+def draw_soft_shadow(img, positioned_lines, font, offset, radius, color):
+    """Ombre douce: masque du texte rasterisé une fois, décalé, flouté puis composité"""
+    margin = int(radius * 3) + 1
+    boxes = [font.getbbox(line) for _, _, line in positioned_lines]
+    left = max(min(x + box[0] for (x, _, _), box in zip(positioned_lines, boxes)) + offset[0] - margin, 0)
+    top = max(min(y + box[1] for (_, y, _), box in zip(positioned_lines, boxes)) + offset[1] - margin, 0)
+    right = min(max(x + box[2] for (x, _, _), box in zip(positioned_lines, boxes)) + offset[0] + margin, img.width)
+    bottom = min(max(y + box[3] for (_, y, _), box in zip(positioned_lines, boxes)) + offset[1] + margin, img.height)
+    if right <= left or bottom <= top:
+        return
+    
+    mask = Image.new('L', (right - left, bottom - top), 0)
+    for x, y, line in positioned_lines:
+        paste_text(mask, (x + offset[0] - left, y + offset[1] - top), line, font, 255)
+    mask = blur_image(mask, radius)
+    img.paste(color, (left, top, right, bottom), mask)
+
+def fit_font_size(text, config, width, height):
+    """Plus grande taille de police dont le bloc de texte tient dans max_width_percent × max_height_percent
+    Recherche dichotomique: chaque essai n'est qu'une passe de mesure (polices et largeurs de mots en cache)"""
+    max_width = int(width * config['max_width_percent'] / 100)
+    max_height = int(height * config.get('max_height_percent', 80) / 100)
+    low = int(config.get('min_font_size', 24))
+    high = int(config.get('max_font_size', 160))
+    best = low
+    
+    while low <= high:
+        size = (low + high) // 2
+        font = get_font(config['font_name'], size)
+        lines = wrap_text(text, font, max_width, config.get('text_wrap', 'greedy'))
+        fits = (len(lines) * int(size * config['line_spacing']) <= max_height
+                and all(measure_text(line, font) <= max_width for line in lines))
+        if fits:
+            best = size
+            low = size + 1
+        else:
+            high = size - 1
+    
+    return best
+
+def compose_base_image(config, width, height, background=None):
+    """Fond, bordure et logo: toute la partie de l'image qui ne dépend pas du texte"""
+    # Créer le fond
+    if background is not None:
+        img = background
+    elif config['background_image']:
+        logger.debug("🖼️ Traitement du background: %s", config['background_image'])
+        img = prepare_background(config, width, height)
+        if img is None:
+            logger.warning("⚠️ Fallback: couleur de fond")
+            # Signalé dans les timings: ce rendu ne doit pas entrer dans les caches
+            metrics.add('background_fallback', 1)
+            img = process_background(Image.new('RGB', (width, height), hex_to_rgb(config['background_color'])),
+                                     width, height, config)
+    elif config.get('background_gradient'):
+        logger.debug("🌈 Création fond dégradé: %s", config['background_gradient'])
+        img = render_gradient(width, height, config['background_gradient'])
+    else:
+        logger.debug("🎨 Création fond couleur unie: %s", config['background_color'])
+        # Couleur unie
+        img = Image.new('RGB', (width, height), hex_to_rgb(config['background_color']))
+    
+    # Ajouter une bordure si demandé
+    if config['add_border']:
+        border = config['border_width']
+        bordered = Image.new('RGB', (width + border*2, height + border*2), hex_to_rgb(config['border_color']))
+        bordered.paste(img, (border, border))
+        img = bordered.resize((width, height), Image.Resampling.LANCZOS)
+    
+    # Ajouter un logo si demandé
+    if config['add_logo'] and config['logo_path']:
+        logo_path = Path(app.config['BACKGROUNDS_FOLDER']) / config['logo_path']
+        if logo_path.exists():
+            logo = Image.open(logo_path).convert('RGBA')
+            logo.thumbnail((config['logo_size'], config['logo_size']), Image.Resampling.LANCZOS)
             
-            # Appliquer le blur si demandé
-            if config['background_blur'] > 0:
-                print(f"🌫️ Application blur: {config['background_blur']}")
-                img = img.filter(ImageFilter.GaussianBlur(radius=config['background_blur']))
+            # Position du logo
+            positions = {
+                'top_left': (20, 20),
+                'top_right': (width - logo.width - 20, 20),
+                'bottom_left': (20, height - logo.height - 20),
+                'bottom_right': (width - logo.width - 20, height - logo.height - 20)
+            }
             
-            # Overlay sombre
-            if config['background_overlay']:
-                print(f"🎭 Application overlay: opacité {config['overlay_opacity']}")
-                overlay = Image.new('RGBA', (width, height), (0, 0, 0, int(255 * config['overlay_opacity'])))
-                img = img.convert('RGBA')
-                img = Image.alpha_composite(img, overlay)
-                img = img.convert('RGB')
+            pos = positions.get(config['logo_position'], (width - logo.width - 20, 20))
+            img.paste(logo, pos, logo)
+    
+    return img
+
+def render_duaa_image(duaa_text, config, background=None):
+    """Dessine l'image de dou'a en mémoire et retourne l'image Pillow
+    background: fond déjà préparé aux bonnes dimensions (optionnel)"""
+    # Dimensions
+    width, height = canvas_size(config)
+    
+    logger.debug("📐 Dimensions: %sx%s", width, height)
+    
+    # Base (fond + bordure + logo): précomposée une fois par template
+    with metrics.stage('compose'):
+        if config.get('template'):
+            img = template_store.base_image(config, width, height,
+                                            lambda: compose_base_image(config, width, height, background))
         else:
-            print(f"🎨 Création fond couleur unie: {config['background_color']}")
-            # Couleur unie
-            img = Image.new('RGB', (width, height), hex_to_rgb(config['background_color']))
-        
-        # Ajouter une bordure si demandé
-        if config['add_border']:
-            border = config['border_width']
-            bordered = Image.new('RGB', (width + border*2, height + border*2), hex_to_rgb(config['border_color']))
-            bordered.paste(img, (border, border))
-            img = bordered.resize((width, height), Image.Resampling.LANCZOS)
+            img = compose_base_image(config, width, height, background)
+    
+    with metrics.stage('layout'):
+        # Nettoyer le texte arabe (SANS reshaper pour l'instant)
+        duaa_text = clean_arabic_text(duaa_text)
+        max_text_width = int(width * config['max_width_percent'] / 100)
         
-        draw = ImageDraw.Draw(img)
+        # Taille automatique: la plus grande qui tient dans le cadre
+        if config.get('auto_fit'):
+            config = dict(config, font_size=fit_font_size(duaa_text, config, width, height))
+            logger.debug("🔠 Taille auto: %s", config['font_size'])
         
         # Charger la police - le nom peut être juste le nom de fichier
         font = get_font(config['font_name'], config['font_size'])
         
-        # Nettoyer le texte arabe (SANS reshaper pour l'instant)
-        duaa_text = clean_arabic_text(duaa_text)
-        
         # Découper le texte en lignes AVANT de reshaper
-        max_text_width = int(width * config['max_width_percent'] / 100)
-        lines = wrap_text(duaa_text, font, max_text_width)
+        lines = wrap_text(duaa_text, font, max_text_width, config.get('text_wrap', 'greedy'))
         
         # MAINTENANT reshaper chaque ligne individuellement pour préserver RTL
         reshaped_lines = []
@@ -477,11 +1703,15 @@ def generate_duaa_image(duaa_text, config, output_path):
         line_height = int(config['font_size'] * config['line_spacing'])
         total_text_height = len(reshaped_lines) * line_height
         
+        if total_text_height > height:
+            logger.warning("⚠️ Texte trop long: %spx pour %spx de hauteur (essayez auto_fit)", total_text_height, height)
+        
         # Position de départ (centré verticalement)
         y = (height - total_text_height) // 2
         
-        # Dessiner chaque ligne
+        # Positionner chaque ligne
         text_color = hex_to_rgb(config['text_color'])
+        positioned_lines = []
         
         for line in reshaped_lines:
             bbox = font.getbbox(line)
@@ -495,99 +1725,1273 @@ def generate_duaa_image(duaa_text, config, output_path):
             else:  # right
                 x = width - (width - max_text_width) // 2 - text_width
             
-            # Ombre portée
-            if config['text_shadow']:
-                shadow_color = hex_to_rgb(config['shadow_color'])
-                shadow_x = x + config['shadow_offset'][0]
-                shadow_y = y + config['shadow_offset'][1]
-                draw.text((shadow_x, shadow_y), line, font=font, fill=shadow_color)
-            
-            # Contour
-            if config['text_outline']:
-                outline_color = hex_to_rgb(config['outline_color'])
-                for adj_x in range(-config['outline_width'], config['outline_width']+1):
-                    for adj_y in range(-config['outline_width'], config['outline_width']+1):
-                        draw.text((x+adj_x, y+adj_y), line, font=font, fill=outline_color)
-            
-            # Texte principal
-            draw.text((x, y), line, font=font, fill=text_color)
-            
+            positioned_lines.append((x, y, line))
             y += line_height
+    
+    with metrics.stage('draw'):
+        # Ombre portée
+        if config['text_shadow']:
+            shadow_color = hex_to_rgb(config['shadow_color'])
+            shadow_dx, shadow_dy = config['shadow_offset'][0], config['shadow_offset'][1]
+            if config.get('shadow_blur', 0) > 0:
+                draw_soft_shadow(img, positioned_lines, font, (shadow_dx, shadow_dy),
+                                 config['shadow_blur'], shadow_color)
+            else:
+                for x, y, line in positioned_lines:
+                    paste_text(img, (x + shadow_dx, y + shadow_dy), line, font, shadow_color)
+        
+        # Texte principal (contour rendu en une passe via stroke_width)
+        outline_width = config['outline_width'] if config['text_outline'] else 0
+        outline_color = hex_to_rgb(config['outline_color']) if outline_width else None
+        for x, y, line in positioned_lines:
+            paste_text(img, (x, y), line, font, text_color, outline_width, outline_color)
         
         # Ajouter un footer si demandé
         if config['add_footer'] and config['footer_text']:
             footer_font = get_font(config['font_name'], config['footer_font_size'])
-            footer_text = reshape_arabic_text(config['footer_text'])
+            footer_text = reshape_arabic_text(clean_arabic_text(config['footer_text']))
             footer_bbox = footer_font.getbbox(footer_text)
             footer_width = footer_bbox[2] - footer_bbox[0]
             footer_x = (width - footer_width) // 2
             footer_y = height - config['footer_font_size'] - 30
             
             footer_color = hex_to_rgb(config['footer_color'])
-            draw.text((footer_x, footer_y), footer_text, font=footer_font, fill=footer_color)
-        
-        # Ajouter un logo si demandé
-        if config['add_logo'] and config['logo_path']:
-            logo_path = Path(app.config['BACKGROUNDS_FOLDER']) / config['logo_path']
-            if logo_path.exists():
-                logo = Image.open(logo_path).convert('RGBA')
-                logo.thumbnail((config['logo_size'], config['logo_size']), Image.Resampling.LANCZOS)
-                
-                # Position du logo
-                positions = {
-                    'top_left': (20, 20),
-                    'top_right': (width - logo.width - 20, 20),
-                    'bottom_left': (20, height - logo.height - 20),
-                    'bottom_right': (width - logo.width - 20, height - logo.height - 20)
-                }
-                
-                pos = positions.get(config['logo_position'], (width - logo.width - 20, 20))
-                img.paste(logo, pos, logo)
-        
-        # Sauvegarder
-        if config['format_output'].upper() == 'PNG':
-            img.save(output_path, 'PNG', quality=config['quality'], optimize=True)
-        else:
-            img.save(output_path, 'JPEG', quality=config['quality'], optimize=True)
-        
-        print(f"✅ Image générée: {output_path}")
-        return True
-        
-    except Exception as e:
-        print(f"❌ Erreur génération: {e}")
-        import traceback
-        traceback.print_exc()
+            paste_text(img, (footer_x, footer_y), footer_text, footer_font, footer_color)
+    
+    return img
+
+OUTPUT_FORMATS = {
+    'PNG': {'ext': 'png', 'mimetype': 'image/png'},
+    'JPEG': {'ext': 'jpg', 'mimetype': 'image/jpeg'},
+    'WEBP': {'ext': 'webp', 'mimetype': 'image/webp'},
+    'AVIF': {'ext': 'avif', 'mimetype': 'image/avif'}
+}
+
+# Réglages d'encodage par profil: fast (CPU minimal), balanced, small (fichier minimal)
+ENCODER_PROFILES = {
+    'fast': {
+        'PNG': {'compress_level': 1},
+        'JPEG': {'optimize': False},
+        'WEBP': {'method': 0},
+        'AVIF': {'speed': 10}
+    },
+    'balanced': {
+        'PNG': {'compress_level': 6},
+        'JPEG': {'optimize': True},
+        'WEBP': {'method': 4},
+        'AVIF': {'speed': 6}
+    },
+    'small': {
+        'PNG': {'optimize': True},
+        'JPEG': {'optimize': True, 'progressive': True},
+        'WEBP': {'method': 6},
+        'AVIF': {'speed': 2}
+    }
+}
+
+def output_format(config):
+    """Format Pillow de sortie (PNG par défaut, JPEG pour une valeur inconnue)"""
+    fmt = config['format_output'].upper()
+    if fmt == 'JPG':
+        return 'JPEG'
+    return fmt if fmt in OUTPUT_FORMATS else 'JPEG'
+
+_available_formats = []
+
+def available_output_formats():
+    """Formats réellement encodables ici (AVIF demande le paquet pillow-avif-plugin sur Pillow < 11)"""
+    if not _available_formats:
+        try:
+            import pillow_avif  # noqa: F401 (enregistre le plugin AVIF)
+        except ImportError:
+            pass
+        Image.init()
+        _available_formats.extend(fmt for fmt in OUTPUT_FORMATS if fmt in Image.SAVE)
+    return _available_formats
+
+def encoder_options(fmt, config):
+    """Arguments de Image.save pour ce format, selon le profil et les surcharges de la config"""
+    profile = config.get('encoder_profile') or 'balanced'
+    if profile not in ENCODER_PROFILES:
+        raise ValueError(f"Profil d'encodage inconnu: {profile}")
+    options = dict(ENCODER_PROFILES[profile][fmt])
+    if fmt in ('JPEG', 'WEBP', 'AVIF'):
+        options['quality'] = config['quality']
+    if fmt == 'JPEG' and config.get('jpeg_subsampling'):
+        options['subsampling'] = config['jpeg_subsampling']
+    if fmt in ('WEBP', 'AVIF') and config.get('lossless'):
+        options['lossless'] = True
+    return options
+
+def encoder_config_error(config):
+    """Message d'erreur si le format ou le profil de sortie demandé n'est pas utilisable, sinon None"""
+    fmt = output_format(config)
+    if fmt not in available_output_formats():
+        return f"Format de sortie {fmt} indisponible sur ce serveur (AVIF: installer pillow-avif-plugin)"
+    if (config.get('encoder_profile') or 'balanced') not in ENCODER_PROFILES:
+        return f"encoder_profile doit être parmi {', '.join(ENCODER_PROFILES)}"
+    return None
+
+class EncoderStats:
+    """Temps d'encodage et poids moyens par format et profil (dans ce worker)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, fmt, profile, timings):
+        with self._lock:
+            stats = self._stats.setdefault(f"{fmt}/{profile}",
+                                           {'count': 0, 'quantize_ms': 0.0, 'encode_ms': 0.0, 'bytes': 0})
+            stats['count'] += 1
+            stats['quantize_ms'] += timings.get('quantize_ms', 0.0)
+            stats['encode_ms'] += timings['encode_ms']
+            stats['bytes'] += timings['bytes']
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {
+                    'count': stats['count'],
+                    'avg_quantize_ms': round(stats['quantize_ms'] / stats['count'], 1),
+                    'avg_encode_ms': round(stats['encode_ms'] / stats['count'], 1),
+                    'avg_kb': round(stats['bytes'] / stats['count'] / 1024, 1)
+                }
+                for name, stats in self._stats.items()
+            }
+
+encoder_stats = EncoderStats()
+
+def encode_image(img, config, timings=None):
+    """Encode l'image dans un buffer mémoire et retourne les octets
+    timings (dict optionnel) reçoit quantize_ms, encode_ms et bytes"""
+    fmt = output_format(config)
+    options = encoder_options(fmt, config)
+    
+    with metrics.collect(timings):
+        quantize = {}
+        if fmt == 'PNG' and config.get('png_palette'):
+            with metrics.stage('quantize') as quantize:
+                img = img.quantize(colors=min(int(config['png_palette']), 256), method=Image.Quantize.FASTOCTREE,
+                                   dither=Image.Dither.NONE)
+        
+        with metrics.stage('encode') as encode:
+            buffer = BytesIO()
+            img.save(buffer, fmt, **options)
+            data = buffer.getvalue()
+        metrics.add('bytes', len(data))
+    
+    encoder_stats.record(fmt, config.get('encoder_profile') or 'balanced',
+                         {'quantize_ms': quantize.get('ms', 0.0), 'encode_ms': encode['ms'], 'bytes': len(data)})
+    return data
+
+def render_duaa_bytes(duaa_text, config, background=None, timings=None):
+    """Rendu + encodage en mémoire, sans rien écrire sur le disque
+    timings (dict optionnel) reçoit la durée de chaque étape (<étape>_ms) et bytes"""
+    with metrics.collect(timings):
+        started = time.perf_counter()
+        with metrics.stage('render'):
+            img = render_duaa_image(duaa_text, config, background)
+        data = encode_image(img, config)
+    if config.get('template'):
+        template_store.record_render(config['template'], (time.perf_counter() - started) * 1000)
+    return data
+
+def generate_duaa_image(duaa_text, config, output_path, background=None, timings=None):
+    """Génère l'image de dou'a"""
+    try:
+        with metrics.collect(timings):
+            data = render_duaa_bytes(duaa_text, config, background)
+            
+            # Sauvegarder (fichier temporaire puis renommage atomique: jamais de fichier partiel visible)
+            with metrics.stage('write'):
+                tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, output_path)
+        
+        logger.debug("✅ Image générée: %s", output_path)
+        return True
+        
+    except Exception as e:
+        logger.exception("❌ Erreur génération: %s", e)
         return False
 
-def process_image_job(job_id, duaa_text, config, output_name):
-    """Traite un job de génération d'image"""
+# ============================================
+# MOTEUR DE RENDU
+# ============================================
+class ThreadRenderEngine:
+    """Rendus exécutés directement dans les threads du scheduler (par défaut)"""
+    local = True  # les ressources préparées dans ce processus (fonds, polices) servent au rendu
+
+    def generate_duaa_image(self, duaa_text, config, output_path, background=None, timings=None):
+        return generate_duaa_image(duaa_text, config, output_path, background, timings)
+
+    def render_duaa_bytes(self, duaa_text, config, timings=None):
+        return render_duaa_bytes(duaa_text, config, timings=timings)
+
+    def stats(self):
+        return {'engine': 'thread'}
+
+def _render_process_init():
+    """Initialiseur d'un processus de rendu: l'import du module a déjà validé et préchargé
+    les polices, initialisé le reshaper et fait un rendu d'essai (warm_up)"""
+    if not readiness['ready']:
+        logger.warning("⚠️ Processus de rendu %s sans police arabe valide", os.getpid())
+    logger.debug("🔧 Processus de rendu prêt: %s", os.getpid())
+
+def _render_in_process(spec):
+    """Exécuté dans un processus de rendu: spec JSON (texte, config, chemin) -> image écrite sur disque
+    Seuls un booléen et les durées reviennent, jamais les pixels"""
+    spec = json.loads(spec)
+    timings = {}
+    ok = generate_duaa_image(spec['text'], spec['config'], spec['path'], timings=timings)
+    return {'ok': ok, 'timings': timings}
+
+def replay_timings(config, child_timings, timings=None):
+    """Reporte dans ce processus les durées mesurées par un processus de rendu: histogrammes
+    (une valeur par étape et par rendu), statistiques d'encodage et du template, timings du job"""
+    with metrics.collect(timings):
+        for key, value in child_timings.items():
+            if key.endswith('_ms'):
+                metrics.observe('duaa_stage_duration_seconds', {'stage': key[:-3]}, value / 1000)
+            metrics.add(key, value)
+    if 'encode_ms' in child_timings:
+        encoder_stats.record(output_format(config), config.get('encoder_profile') or 'balanced',
+                             {key: child_timings.get(key, 0.0) for key in ('quantize_ms', 'encode_ms', 'bytes')})
+    if config.get('template'):
+        template_store.record_render(config['template'], sum(child_timings.get(key, 0.0)
+                                                             for key in ('render_ms', 'quantize_ms', 'encode_ms')))
+
+class ProcessRenderEngine:
+    """Rendus dans un pool de processus (RENDER_ENGINE=process): le découpage en lignes,
+    arabic_reshaper et python-bidi tiennent le GIL, un seul processus plafonne à un cœur.
+    Chaque job part en JSON compact (texte, config, chemin de sortie) et l'image revient
+    par fichier: rien n'est sérialisé pixel par pixel"""
+    local = False
+
+    def __init__(self, processes):
+        self.processes = processes
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self.submitted = 0
+        self.failed = 0
+        self.restarts = 0
+
+    def _executor(self):
+        # Pool créé paresseusement dans chaque worker gunicorn; processus lancés par spawn
+        # (un fork hériterait des threads et verrous du worker)
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.processes,
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_render_process_init)
+                self._pid = os.getpid()
+            self.submitted += 1
+            return self._pool
+
+    def _run(self, duaa_text, config, path):
+        pool = self._executor()
+        spec = json.dumps({'text': duaa_text, 'config': config, 'path': str(path)}, default=str)
+        try:
+            result = pool.submit(_render_in_process, spec).result()
+        except BrokenProcessPool:
+            # Un processus de rendu est mort (mémoire...): pool recréé au rendu suivant
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+                    self.restarts += 1
+                self.failed += 1
+            raise
+        if not result['ok']:
+            with self._lock:
+                self.failed += 1
+        return result
+
+    def generate_duaa_image(self, duaa_text, config, output_path, background=None, timings=None):
+        """Comme generate_duaa_image; background est ignoré (chaque processus a son cache de fonds)"""
+        try:
+            result = self._run(duaa_text, config, output_path)
+        except Exception as e:
+            logger.error("❌ Erreur processus de rendu: %s", e)
+            return False
+        replay_timings(config, result['timings'], timings)
+        return result['ok']
+
+    def render_duaa_bytes(self, duaa_text, config, timings=None):
+        """Comme render_duaa_bytes; l'image transite par un fichier de temp/render"""
+        path = Path(app.config['TEMP_FOLDER']) / 'render' / f"{uuid.uuid4().hex}.{OUTPUT_FORMATS[output_format(config)]['ext']}"
+        path.parent.mkdir(exist_ok=True)
+        try:
+            result = self._run(duaa_text, config, path)
+            if not result['ok']:
+                raise RuntimeError('Erreur lors de la génération')
+            replay_timings(config, result['timings'], timings)
+            return path.read_bytes()
+        finally:
+            path.unlink(missing_ok=True)
+
+    def stats(self):
+        return {
+            'engine': 'process',
+            'processes': self.processes,
+            'submitted': self.submitted,
+            'failed': self.failed,
+            'restarts': self.restarts
+        }
+
+def create_render_engine():
+    engine = app.config['RENDER_ENGINE']
+    if engine == 'process':
+        return ProcessRenderEngine(app.config['RENDER_PROCESSES'])
+    if engine != 'thread':
+        logger.warning("⚠️ RENDER_ENGINE inconnu: %s, utilisation de thread", engine)
+    return ThreadRenderEngine()
+
+render_engine = create_render_engine()
+
+# ============================================
+# TEMPLATES
+# ============================================
+# Options qui composent la base (fond, bordure, logo) d'un template
+BASE_CONFIG_KEYS = (
+    'background_image', 'background_gradient', 'background_color', 'background_blur',
+    'background_overlay', 'overlay_opacity', 'add_border', 'border_width', 'border_color',
+    'add_logo', 'logo_path', 'logo_position', 'logo_size'
+)
+
+class TemplateNotFoundError(KeyError):
+    """Template inconnu"""
+
+class TemplateStore:
+    """Mises en page nommées, stockées en JSON dans data/templates/ (partagées entre workers),
+    dont la base (fond + bordure + logo) est précomposée une fois et gardée en mémoire"""
+    NAME_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+    def __init__(self, folder, cache_bytes):
+        self.folder = Path(folder)
+        self.bases = LRUCache(maxsize=64, max_bytes=cache_bytes,
+                              sizeof=lambda img: img.width * img.height * len(img.getbands()))
+        self._lock = threading.Lock()
+        self._render_stats = {}
+
+    def validate_name(self, name):
+        if not self.NAME_RE.match(name or ''):
+            raise ValueError("Nom de template invalide (lettres, chiffres, _ et -, 64 max)")
+        return name
+
+    def _path(self, name):
+        return self.folder / f"{self.validate_name(name)}.json"
+
+    def _write(self, template):
+        path = self._path(template['name'])
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps(template, ensure_ascii=False))
+        os.replace(tmp_path, path)
+        return template
+
+    def save(self, name, config):
+        """Enregistre (ou remplace) un template; une nouvelle version invalide les bases en cache"""
+        return self._write({
+            'name': name,
+            'config': config,
+            'version': uuid.uuid4().hex[:12],
+            'updated_at': datetime.now().isoformat()
+        })
+
+    def get(self, name):
+        try:
+            return json.loads(self._path(name).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def list(self):
+        templates = []
+        for path in sorted(self.folder.glob('*.json')):
+            template = self.get(path.stem)
+            if template is not None:
+                template['render_stats'] = self.render_stats(path.stem)
+                templates.append(template)
+        return templates
+
+    def invalidate(self, name):
+        """Change la version du template: tous les workers recomposeront sa base"""
+        template = self.get(name)
+        if template is None:
+            return None
+        return self.save(name, template['config'])
+
+    def delete(self, name):
+        path = self._path(name)
+        if not path.exists():
+            return False
+        path.unlink()
+        return True
+
+    def base_image(self, config, width, height, build):
+        """Copie de la base précomposée du template (construite au premier usage); une base dont
+        le fond image est retombé sur la couleur unie n'est pas gardée (réessayée au rendu suivant)"""
+        base_config = json.dumps({key: config.get(key) for key in BASE_CONFIG_KEYS}, sort_keys=True, default=str)
+        key = (config['template'], config.get('template_version'), width, height, base_config)
+        base = self.bases.get(key)
+        if base is None:
+            probe = {}
+            with metrics.collect(probe):
+                base = build()
+            if probe.get('background_fallback'):
+                return base
+            self.bases.put(key, base)
+        return base.copy()
+
+    def record_render(self, name, elapsed_ms):
+        with self._lock:
+            stats = self._render_stats.setdefault(name, {'renders': 0, 'total_ms': 0.0, 'last_ms': 0.0})
+            stats['renders'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['last_ms'] = round(elapsed_ms, 1)
+
+    def render_stats(self, name):
+        """Temps de rendu des jobs de ce template (dans ce worker)"""
+        with self._lock:
+            stats = dict(self._render_stats.get(name, {'renders': 0, 'total_ms': 0.0, 'last_ms': 0.0}))
+        stats['avg_ms'] = round(stats['total_ms'] / stats['renders'], 1) if stats['renders'] else 0.0
+        stats['total_ms'] = round(stats['total_ms'], 1)
+        return stats
+
+template_store = TemplateStore(app.config['TEMPLATES_FOLDER'], app.config['TEMPLATE_CACHE_MB'] * 1024 * 1024)
+
+# ============================================
+# CACHE DES RENDUS
+# ============================================
+class RenderCache:
+    """Rendus adressés par contenu dans outputs/ (ca-<clé>.<ext>), avec regroupement
+    des requêtes identiques en cours et éviction par taille et par âge"""
+    def __init__(self, folder, max_bytes, max_age_seconds):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # nom -> (taille, date de création), du plus ancien au plus récent
+        self._bytes = 0
+        self._inflight = {}  # clé -> [(job_id, output_name), ...] des requêtes en attente du même rendu
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        for path in sorted(self.folder.glob('ca-*'), key=lambda p: p.stat().st_mtime):
+            self._register(path)
+
+    def key(self, duaa_text, config):
+        """Empreinte du texte normalisé, de la config fusionnée et du fichier de police"""
+        background = config.get('background_image')
+        if background and not background.startswith('http'):
+            bg_path = Path(app.config['BACKGROUNDS_FOLDER']) / background
+            if bg_path.exists():
+                stat = bg_path.stat()
+                background = f"{background}:{stat.st_mtime_ns}:{stat.st_size}"
+        payload = json.dumps({
+            'text': clean_arabic_text(duaa_text),
+            'config': config,
+            'background': background,
+            'font': font_registry.digest(config['font_name'])
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:40]
+
+    def path(self, key, config):
+        return self.folder / f"ca-{key}.{OUTPUT_FORMATS[output_format(config)]['ext']}"
+
+    def _register(self, path):
+        """Ajoute un fichier à l'index (appelé avec ou sans verrou selon le contexte)"""
+        try:
+            stat = path.stat()
+        except OSError:
+            return
+        if path.name in self._entries:
+            self._bytes -= self._entries.pop(path.name)[0]
+        self._entries[path.name] = (stat.st_size, stat.st_mtime)
+        self._bytes += stat.st_size
+
+    def lookup(self, key, config):
+        """Chemin du rendu en cache ou None"""
+        path = self.path(key, config)
+        with self._lock:
+            if path.exists():
+                self.hits += 1
+                if path.name not in self._entries:  # rendu par un autre worker
+                    self._register(path)
+                return path
+            self.misses += 1
+            return None
+
+    def add(self, path):
+        with self._lock:
+            self._register(Path(path))
+            self._evict()
+
+    def _evict(self):
+        """Supprime les rendus les plus anciens au-delà du quota ou de l'âge maximum"""
+        now = time.time()
+        while self._entries:
+            name, (size, created) = next(iter(self._entries.items()))
+            if self._bytes <= self.max_bytes and now - created <= self.max_age_seconds:
+                break
+            self._entries.popitem(last=False)
+            self._bytes -= size
+            (self.folder / name).unlink(missing_ok=True)
+            self.evictions += 1
+
+    def evict_expired(self):
+        """Éviction par âge même sans nouveau rendu (appelée par le nettoyage périodique)"""
+        with self._lock:
+            before = self.evictions
+            self._evict()
+            return self.evictions - before
+
+    def join(self, key, job_id, output_name):
+        """Inscrit une requête sur la clé; retourne le job leader si un rendu identique est déjà en cours"""
+        with self._lock:
+            if key in self._inflight:
+                self._inflight[key].append((job_id, output_name))
+                self.coalesced += 1
+                return self._inflight[key][0][0]
+            self._inflight[key] = [(job_id, output_name)]
+            return None
+
+    def release(self, key):
+        """Termine le rendu en cours et retourne toutes les requêtes qui l'attendaient"""
+        with self._lock:
+            return self._inflight.pop(key, [])
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'max_age_seconds': self.max_age_seconds,
+            'inflight': len(self._inflight),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
+
+render_cache = RenderCache(
+    app.config['OUTPUT_FOLDER'],
+    max_bytes=app.config['RENDER_CACHE_MAX_MB'] * 1024 * 1024,
+    max_age_seconds=app.config['RENDER_CACHE_MAX_AGE_HOURS'] * 3600
+)
+
+def publish_output(cached_path, output_name):
+    """Expose un rendu en cache sous le nom demandé (lien physique, copie en secours)"""
+    output_path = Path(app.config['OUTPUT_FOLDER']) / f"{output_name}{cached_path.suffix}"
+    if output_path.resolve() == cached_path.resolve():
+        return output_path
+    output_path.unlink(missing_ok=True)
     try:
-        jobs[job_id]['status'] = 'generating'
-        jobs[job_id]['progress'] = 30
-        
-        output_ext = 'png' if config['format_output'].upper() == 'PNG' else 'jpg'
-        output_path = Path(app.config['OUTPUT_FOLDER']) / f"{output_name}.{output_ext}"
-        
-        if generate_duaa_image(duaa_text, config, str(output_path)):
-            jobs[job_id]['status'] = 'completed'
-            jobs[job_id]['progress'] = 100
-            jobs[job_id]['output_path'] = str(output_path)
-            jobs[job_id]['download_url'] = f"/api/download/{output_path.name}"
-            jobs[job_id]['finished_at'] = datetime.now().isoformat()
-            print(f"✅ Job {job_id} terminé")
-        else:
-            jobs[job_id]['status'] = 'error'
-            jobs[job_id]['error'] = 'Erreur lors de la génération'
+        os.link(cached_path, output_path)
+        os.utime(output_path)  # l'âge d'une publication part de maintenant, même pour un rendu ancien
+    except OSError:
+        shutil.copyfile(cached_path, output_path)
+    janitor.track_output(output_path)
+    return output_path
+
+def settle_render(cached_path, timings):
+    """Garde un rendu neuf dans le cache, sauf si son fond image n'a pas pu être chargé
+    (couleur unie de secours, 'background_fallback' dans timings): il est alors sorti de
+    l'espace ca-* pour qu'une nouvelle tentative retélécharge le fond, et doit être supprimé
+    après publication. Retourne (chemin à publier, rendu dégradé)"""
+    if not timings.get('background_fallback'):
+        render_cache.add(cached_path)
+        return cached_path, False
+    degraded_path = cached_path.with_name(f"fallback-{uuid.uuid4().hex[:12]}{cached_path.suffix}")
+    os.replace(cached_path, degraded_path)
+    return degraded_path, True
+
+# ============================================
+# NETTOYAGE
+# ============================================
+class Janitor:
+    """Thread de nettoyage périodique: images publiées dans outputs/ (âge et quota), jobs
+    (âge et nombre), fichiers orphelins de temp/ et fichiers .tmp d'écritures interrompues.
+    Les images publiées sont indexées du plus ancien au plus récent: chaque éviction est en O(1),
+    l'index n'est reconstruit par un parcours du dossier qu'au démarrage et toutes les heures
+    (pour voir les publications des autres workers)"""
+    RESCAN_SECONDS = 3600
+
+    def __init__(self, interval, output_max_age, output_max_bytes, job_max_age, job_max_records, temp_max_age):
+        self.interval = interval
+        self.output_max_age = output_max_age
+        self.output_max_bytes = output_max_bytes
+        self.job_max_age = job_max_age
+        self.job_max_records = job_max_records
+        self.temp_max_age = temp_max_age
+        self.output_folder = Path(app.config['OUTPUT_FOLDER'])
+        self._lock = threading.Lock()
+        self._outputs = OrderedDict()  # nom -> (taille, date de publication)
+        self._bytes = 0
+        self._scanned_at = 0.0
+        self._pid = None
+        self.runs = 0
+        self.last_run = None
+        self.last_duration_ms = 0.0
+        self.evicted = {'outputs': 0, 'jobs': 0, 'temp': 0, 'render_cache': 0}
+        self.errors = 0
+
+    def ensure_started(self):
+        # Démarrage paresseux: le thread ne survit pas au fork des workers gunicorn
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._loop, name='janitor', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                logger.error("❌ Erreur nettoyage: %s", e)
+            time.sleep(self.interval)
+
+    def track_output(self, path):
+        """Ajoute (ou rafraîchit) une image publiée dans l'index"""
+        try:
+            size = path.stat().st_size
+        except OSError:
+            return
+        with self._lock:
+            previous = self._outputs.pop(path.name, None)
+            if previous is not None:
+                self._bytes -= previous[0]
+            self._outputs[path.name] = (size, time.time())
+            self._bytes += size
+
+    def _rescan_outputs(self):
+        """Reconstruit l'index des images publiées (tout sauf le cache ca-* et les .tmp)"""
+        entries = []
+        with os.scandir(self.output_folder) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith('ca-') and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+        with self._lock:
+            self._outputs = OrderedDict((name, (size, mtime)) for mtime, name, size in sorted(entries))
+            self._bytes = sum(size for size, _ in self._outputs.values())
+            self._scanned_at = time.time()
+
+    def _evict_outputs(self):
+        limit = time.time() - self.output_max_age
+        removed = 0
+        while True:
+            with self._lock:
+                if not self._outputs:
+                    break
+                name, (size, published) = next(iter(self._outputs.items()))
+                if published >= limit and self._bytes <= self.output_max_bytes:
+                    break
+                self._outputs.popitem(last=False)
+                self._bytes -= size
+            (self.output_folder / name).unlink(missing_ok=True)
+            removed += 1
+        return removed
+
+    def _remove_orphans(self):
+        """Fichiers .tmp abandonnés (outputs/, data/) et fichiers trop vieux de temp/"""
+        limit = time.time() - self.temp_max_age
+        removed = 0
+        bg_cache = Path(app.config['BG_CACHE_FOLDER']).resolve()
+        for folder, only_tmp in ((app.config['TEMP_FOLDER'], False), (app.config['OUTPUT_FOLDER'], True),
+                                 (app.config['TEMPLATES_FOLDER'], True)):
+            for root, dirs, files in os.walk(folder):
+                # Le cache des fonds a son propre quota
+                dirs[:] = [d for d in dirs if (Path(root) / d).resolve() != bg_cache]
+                for name in files:
+                    if only_tmp and not name.endswith('.tmp'):
+                        continue
+                    path = Path(root) / name
+                    try:
+                        if path.stat().st_mtime < limit:
+                            path.unlink()
+                            removed += 1
+                    except OSError:
+                        continue
+        return removed
+
+    def run_once(self):
+        started = time.perf_counter()
+        if time.time() - self._scanned_at > self.RESCAN_SECONDS:
+            self._rescan_outputs()
+        evicted = {
+            'outputs': self._evict_outputs(),
+            'jobs': job_store.evict(self.job_max_age, self.job_max_records),
+            'temp': self._remove_orphans(),
+            'render_cache': render_cache.evict_expired()
+        }
+        with self._lock:
+            for kind, count in evicted.items():
+                self.evicted[kind] += count
+            self.runs += 1
+            self.last_run = datetime.now().isoformat()
+            self.last_duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        if any(evicted.values()):
+            logger.info("🧹 Nettoyage: %s images, %s jobs, %s fichiers temporaires, %s rendus en cache supprimés",
+                        evicted['outputs'], evicted['jobs'], evicted['temp'], evicted['render_cache'])
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            return {
+                'interval_seconds': self.interval,
+                'runs': self.runs,
+                'last_run': self.last_run,
+                'last_duration_ms': self.last_duration_ms,
+                'outputs': len(self._outputs),
+                'outputs_bytes': self._bytes,
+                'outputs_max_bytes': self.output_max_bytes,
+                'evicted': dict(self.evicted),
+                'errors': self.errors
+            }
+
+janitor = Janitor(
+    interval=app.config['JANITOR_INTERVAL'],
+    output_max_age=app.config['OUTPUT_TTL_HOURS'] * 3600,
+    output_max_bytes=app.config['OUTPUT_MAX_MB'] * 1024 * 1024,
+    job_max_age=app.config['JOB_TTL_HOURS'] * 3600,
+    job_max_records=app.config['JOB_MAX_RECORDS'],
+    temp_max_age=app.config['TEMP_TTL_HOURS'] * 3600
+)
+
+# ============================================
+# FILE D'ATTENTE DES JOBS
+# ============================================
+class QueueFullError(Exception):
+    """La file d'attente des jobs est pleine"""
+    def __init__(self, retry_after):
+        super().__init__("File d'attente pleine")
+        self.retry_after = retry_after
+
+class JobScheduler:
+    """Pool borné de threads de rendu alimenté par une file à priorités
+    (Pillow relâche le GIL pendant le décodage, les filtres et l'encodage)"""
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue = queue.PriorityQueue()
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._pid = None
+        self.queued = 0
+        self.running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self._wait_times = deque(maxlen=500)
+        self._run_times = deque(maxlen=500)
+
+    def _ensure_started(self):
+        # Démarrage paresseux: les threads ne survivent pas au fork des workers gunicorn
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            for i in range(self.workers):
+                threading.Thread(target=self._worker, name=f"render-{i}", daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, fn, *args, priority='normal'):
+        """Ajoute un job à la file; lève QueueFullError si elle est pleine"""
+        self._ensure_started()
+        if not isinstance(priority, int):
+            priority = JOB_PRIORITIES.get(str(priority), JOB_PRIORITIES['normal'])
+        with self._lock:
+            if self.queued >= self.queue_size:
+                self.rejected += 1
+                raise QueueFullError(self.retry_after())
+            self.queued += 1
+            self.submitted += 1
+        future = Future()
+        self._queue.put((priority, next(self._counter), time.monotonic(), fn, args, future))
+        return future
+
+    def _worker(self):
+        while True:
+            _, _, enqueued, fn, args, future = self._queue.get()
+            started = time.monotonic()
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self._wait_times.append(started - enqueued)
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args))
+                    except Exception as e:
+                        future.set_exception(e)
+            finally:
+                run_time = time.monotonic() - started
+                with self._lock:
+                    self.running -= 1
+                    if future.exception() is None:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+                    self._run_times.append(run_time)
+                metrics.observe('duaa_queue_wait_seconds', {}, started - enqueued)
+                metrics.observe('duaa_job_duration_seconds', {'job': fn.__name__}, run_time)
+
+    def retry_after(self):
+        """Estimation (secondes) du temps nécessaire pour vider la file"""
+        run_times = list(self._run_times)
+        avg_run = sum(run_times) / len(run_times) if run_times else 1.0
+        return max(1, math.ceil(self.queued * avg_run / self.workers))
+
+    def stats(self):
+        waits = sorted(self._wait_times)
+        return {
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'queued': self.queued,
+            'running': self.running,
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'completed': self.completed,
+            'failed': self.failed,
+            'wait_ms': {
+                'avg': round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                'p95': round(percentile(waits, 0.95) * 1000, 1),
+                'max': round(waits[-1] * 1000, 1) if waits else 0.0
+            }
+        }
+
+scheduler = JobScheduler(app.config['WORKER_POOL_SIZE'], app.config['JOB_QUEUE_SIZE'])
+
+# Rendus simultanés par worker, toutes origines confondues: un batch occupe un thread du scheduler
+# et rend ses éléments dans batch_executor, sans dépasser WORKER_POOL_SIZE au total
+render_slots = threading.BoundedSemaphore(app.config['WORKER_POOL_SIZE'])
+
+# Réveille les long-polls de /api/status quand un job de ce worker se termine
+job_events = threading.Condition()
+
+def build_config(data):
+    """Config par défaut, puis celle du template éventuel, puis celle de la requête"""
+    config = DEFAULT_CONFIG.copy()
+    template_name = data.get('template')
+    if template_name:
+        template = template_store.get(template_name)
+        if template is None:
+            raise TemplateNotFoundError(template_name)
+        config.update(template['config'])
+        config['template'] = template['name']
+        config['template_version'] = template['version']
+    config.update(data.get('config') or {})
+    return config
+
+def cache_url(cached_path):
+    """URL de la copie content-addressed (ca-*, servie en cache immuable), None si le rendu n'est pas en cache"""
+    return f"/api/download/{cached_path.name}" if cached_path is not None else None
+
+def complete_job(job_id, output_path, cached_path=None, **extra):
+    """Marque un job terminé avec son fichier de sortie (et sa copie en cache, si elle existe)"""
+    job_store.update(
+        job_id,
+        status='completed',
+        progress=100,
+        output_path=str(output_path),
+        download_url=f"/api/download/{output_path.name}",
+        cache_url=cache_url(cached_path),
+        finished_at=datetime.now().isoformat(),
+        **extra
+    )
+
+def process_image_job(job_id, duaa_text, config, output_name, queued_at=None, cache_key=None):
+    """Traite un job de génération d'image (rendu dans le cache, puis publié sous output_name)"""
+    waiting = [(job_id, output_name)]
+    success = False
+    error = 'Erreur lors de la génération'
+    render_ms = None
+    degraded = False
+    timings = {}
+    try:
+        try:
+            updates = {'status': 'generating', 'progress': 30}
+            if queued_at is not None:
+                updates['queue_wait_ms'] = round((time.time() - queued_at) * 1000, 1)
+            job_store.update(job_id, **updates)
+            
+            cache_key = cache_key or render_cache.key(duaa_text, config)
+            cached_path = render_cache.path(cache_key, config)
+            
+            with render_slots:
+                started = time.perf_counter()
+                success = render_engine.generate_duaa_image(duaa_text, config, str(cached_path), timings=timings)
+            render_ms = round((time.perf_counter() - started) * 1000, 1)
+            if success:
+                cached_path, degraded = settle_render(cached_path, timings)
+        except Exception as e:
+            logger.error("❌ Erreur job %s: %s", job_id, e)
+            success = False
+            error = str(e)
+        finally:
+            # Toujours libérer la clé: sinon les requêtes identiques suivantes attendraient un leader mort
+            if cache_key is not None:
+                waiting = render_cache.release(cache_key) or waiting
+        
+        for waiting_job_id, waiting_name in waiting:
+            try:
+                if success and degraded and waiting_job_id != job_id:
+                    # Fond de secours: seul ce job le reçoit, les requêtes regroupées doivent réessayer
+                    job_store.update(waiting_job_id, status='error', error="Fond d'image inaccessible, réessayez")
+                elif success:
+                    complete_job(waiting_job_id, publish_output(cached_path, waiting_name),
+                                 None if degraded else cached_path, cache_hit=waiting_job_id != job_id, render_ms=render_ms, timings=timings)
+                    logger.info("✅ Job %s terminé", waiting_job_id)
+                else:
+                    job_store.update(waiting_job_id, status='error', error=error)
+            except Exception as e:
+                logger.error("❌ Erreur job %s: %s", waiting_job_id, e)
+                try:
+                    job_store.update(waiting_job_id, status='error', error=str(e))
+                except Exception:
+                    pass
+    finally:
+        if degraded:
+            cached_path.unlink(missing_ok=True)
+        with job_events:
+            job_events.notify_all()
+
+# ============================================
+# BATCH
+# ============================================
+def expand_batch_items(data, job_id):
+    """Liste des éléments d'un batch: "items" explicites, ou produit texts × formats × configs
+    Sans output_prefix, les noms contiennent l'id du batch (deux batchs ne s'écrasent pas)"""
+    base_config = data.get('config') or {}
+    prefix = sanitize_filename(data.get('output_prefix') or f"batch_{job_id}")
+    items = []
+    if data.get('items'):
+        for item in data['items']:
+            items.append({
+                'duaa_text': item.get('duaa_text'),
+                'output_name': item.get('output_name'),
+                'template': item.get('template') or data.get('template'),
+                'config': dict(base_config, **(item.get('config') or {}))
+            })
+    else:
+        for text in data.get('texts') or []:
+            for fmt in data.get('formats') or [None]:
+                for variant in data.get('configs') or [{}]:
+                    config = dict(base_config, **variant)
+                    if fmt:
+                        config['format'] = fmt
+                    items.append({'duaa_text': text, 'output_name': None,
+                                  'template': data.get('template'), 'config': config})
+    
+    for index, item in enumerate(items):
+        item['config'] = build_config({'template': item.pop('template'), 'config': item['config']})
+        if not item['output_name']:
+            item['output_name'] = f"{prefix}_{index + 1:03d}_{item['config']['format']}"
+        item['output_name'] = sanitize_filename(item['output_name'])
+    return items
+
+def prepare_shared_resources(items):
+    """Prépare une fois par groupe (fond, police) ce que les éléments partagent:
+    polices aux tailles utilisées et fonds finis aux dimensions utilisées"""
+    groups = OrderedDict()
+    for item in items:
+        config = item['config']
+        groups.setdefault((config['background_image'], config['font_name']), []).append(item)
+    
+    for (background, font_name), group in groups.items():
+        sizes = {item['config']['font_size'] for item in group}
+        sizes |= {item['config']['footer_font_size'] for item in group if item['config']['add_footer']}
+        for size in sizes:
+            get_font(font_name, size)
+        if background:
+            # Une seule source décodée par réglage de fond, pour toutes les tailles du groupe
+            settings = OrderedDict()
+            for item in group:
+                config = item['config']
+                key = (config['background_blur'], config['background_overlay'], config['overlay_opacity'])
+                settings.setdefault(key, (config, []))[1].append(canvas_size(config))
+            for config, sizes in settings.values():
+                prepare_backgrounds(config, sizes)
+    return [item for group in groups.values() for item in group]
+
+def output_file_id(path):
+    """Identité du fichier publié (périphérique, inode, taille): change si le nom est republié par un autre job"""
+    stat = Path(path).stat()
+    return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}"
+
+def render_batch_item(item):
+    """Rendu d'un élément via le cache des rendus; retourne (chemin publié, chemin en cache ou None)"""
+    config = item['config']
+    cache_key = render_cache.key(item['duaa_text'], config)
+    cached_path = render_cache.lookup(cache_key, config)
+    if cached_path is None:
+        cached_path = render_cache.path(cache_key, config)
+        timings = {}
+        with render_slots:
+            rendered = render_engine.generate_duaa_image(item['duaa_text'], config, str(cached_path), timings=timings)
+        if not rendered:
+            raise RuntimeError('Erreur lors de la génération')
+        cached_path, degraded = settle_render(cached_path, timings)
+        if degraded:
+            try:
+                return publish_output(cached_path, item['output_name']), None
+            finally:
+                cached_path.unlink(missing_ok=True)
+    return publish_output(cached_path, item['output_name']), cached_path
+
+class BatchExecutor:
+    """Pool unique (par worker) pour les éléments de tous les batchs: BATCH_PARALLELISM est un plafond
+    global, pas par batch (N batchs en cours ne lancent pas N × BATCH_PARALLELISM rendus)"""
+    def __init__(self, workers):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def submit(self, fn, *args):
+        # Créé paresseusement: les threads ne survivent pas au fork des workers gunicorn
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='batch')
+                self._pid = os.getpid()
+            return self._executor.submit(fn, *args)
+
+batch_executor = BatchExecutor(app.config['BATCH_PARALLELISM'])
+
+def process_batch_job(job_id, items, queued_at=None):
+    """Traite un batch: ressources partagées préparées une fois, éléments rendus en parallèle"""
+    lock = threading.Lock()
+    statuses = [{'index': i, 'output_name': item['output_name'], 'format': item['config']['format'],
+                 'status': 'queued', 'download_url': None, 'cache_url': None, 'error': None}
+                for i, item in enumerate(items)]
+    done = [0]
+    last_write = [0.0]
+    
+    def run(index, item):
+        timings = {}
+        try:
+            with metrics.collect(timings):
+                output_path, cached_path = render_batch_item(item)
+            update = {'status': 'completed', 'download_url': f"/api/download/{output_path.name}",
+                      'cache_url': cache_url(cached_path), 'file_id': output_file_id(output_path), 'timings': timings}
+        except Exception as e:
+            logger.error("❌ Erreur batch %s élément %s: %s", job_id, index, e)
+            update = {'status': 'error', 'error': str(e)}
+        with lock:
+            statuses[index].update(update)
+            done[0] += 1
+            # Progression écrite au plus toutes les 250 ms (la liste entière est réécrite à chaque fois)
+            now = time.monotonic()
+            if now - last_write[0] < 0.25:
+                return
+            last_write[0] = now
+            job_store.update(job_id, items=statuses, completed_items=done[0],
+                             progress=int(done[0] * 100 / len(items)))
+    
+    try:
+        updates = {'status': 'generating', 'items': statuses}
+        if queued_at is not None:
+            updates['queue_wait_ms'] = round((time.time() - queued_at) * 1000, 1)
+        job_store.update(job_id, **updates)
+        
+        for index, item in enumerate(items):
+            item['index'] = index
+        timings = {}
+        with metrics.collect(timings):
+            # Avec des processus de rendu, chacun prépare ses propres ressources
+            ordered = prepare_shared_resources(items) if render_engine.local else items
+        job_store.update(job_id, timings=timings)
+        
+        wait_futures([batch_executor.submit(run, item['index'], item) for item in ordered])
+        
+        failed = sum(1 for status in statuses if status['status'] == 'error')
+        job_store.update(
+            job_id,
+            items=statuses,
+            completed_items=done[0],
+            progress=100,
+            status='completed' if failed < len(items) else 'error',
+            failed_items=failed,
+            error=f"{failed} élément(s) en erreur" if failed else None,
+            finished_at=datetime.now().isoformat()
+        )
+        logger.info("✅ Batch %s terminé (%s/%s)", job_id, len(items) - failed, len(items))
+    except Exception as e:
+        logger.error("❌ Erreur batch %s: %s", job_id, e)
+        job_store.update(job_id, status='error', error=str(e))
+    finally:
+        with job_events:
+            job_events.notify_all()
+
+def render_duaa_variants(duaa_text, config, formats):
+    """Rendu d'une dou'a dans plusieurs formats en une passe: texte reshapé et mots mesurés
+    une fois (caches partagés), fonds de toutes les tailles dérivés d'une seule source décodée
+    Retourne [(format, chemin en cache, servi depuis le cache, fond de secours)]"""
+    variants = []
+    for fmt in dict.fromkeys(formats):
+        variant_config = dict(config, format=fmt)
+        cache_key = render_cache.key(duaa_text, variant_config)
+        variants.append((fmt, variant_config, cache_key, render_cache.lookup(cache_key, variant_config)))
+    
+    missing = [(fmt, variant_config, cache_key) for fmt, variant_config, cache_key, cached in variants if cached is None]
+    backgrounds = {}
+    if missing and config['background_image'] and render_engine.local:
+        backgrounds = prepare_backgrounds(config, [canvas_size(variant_config) for _, variant_config, _ in missing])
+    
+    results = []
+    for fmt, variant_config, cache_key, cached_path in variants:
+        if cached_path is not None:
+            results.append((fmt, cached_path, True, False))
+            continue
+        cached_path = render_cache.path(cache_key, variant_config)
+        background = backgrounds.get(canvas_size(variant_config))
+        timings = {}
+        with render_slots:
+            rendered = render_engine.generate_duaa_image(duaa_text, variant_config, str(cached_path), background, timings)
+        if not rendered:
+            raise RuntimeError(f"Erreur lors de la génération ({fmt})")
+        cached_path, degraded = settle_render(cached_path, timings)
+        results.append((fmt, cached_path, False, degraded))
+    return results
+
+def process_fanout_job(job_id, duaa_text, config, formats, output_name, queued_at=None):
+    """Traite un job multi-formats: toutes les variantes d'un même texte dans un seul job"""
+    try:
+        updates = {'status': 'generating', 'progress': 30}
+        if queued_at is not None:
+            updates['queue_wait_ms'] = round((time.time() - queued_at) * 1000, 1)
+        job_store.update(job_id, **updates)
+        
+        variants = []
+        timings = {}
+        with metrics.collect(timings):
+            rendered = render_duaa_variants(duaa_text, config, formats)
+        for fmt, cached_path, cache_hit, degraded in rendered:
+            output_path = publish_output(cached_path, f"{output_name}_{fmt}")
+            if degraded:
+                cached_path.unlink(missing_ok=True)
+            variants.append({'format': fmt, 'output_path': str(output_path),
+                             'download_url': f"/api/download/{output_path.name}",
+                             'cache_url': cache_url(None if degraded else cached_path), 'cache_hit': cache_hit})
+        
+        job_store.update(
+            job_id,
+            status='completed',
+            progress=100,
+            variants=variants,
+            timings=timings,
+            output_path=variants[0]['output_path'],
+            download_url=variants[0]['download_url'],
+            cache_url=variants[0]['cache_url'],
+            finished_at=datetime.now().isoformat()
+        )
+        logger.info("✅ Job %s terminé (%s formats)", job_id, len(variants))
+    except Exception as e:
+        logger.error("❌ Erreur job %s: %s", job_id, e)
+        job_store.update(job_id, status='error', error=str(e))
+    finally:
+        with job_events:
+            job_events.notify_all()
+
+class ZipStream:
+    """Fichier en écriture seule vidé au fil de l'eau, pour générer un ZIP en streaming"""
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip(paths):
+    """Génère un ZIP (sans recompression des images) fichier par fichier"""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for path in paths:
+            archive.write(path, arcname=path.name)
+            yield stream.drain()
+    yield stream.drain()
+
+# ============================================
+# DÉMARRAGE
+# ============================================
+WARMUP_TEXT = "بِسْمِ اللَّهِ الرَّحْمَٰنِ الرَّحِيمِ"
+
+readiness = {'ready': False, 'fonts': [], 'invalid_fonts': {}, 'steps_ms': {}, 'error': None}
+
+def warm_up():
+    """Préchauffage avant d'accepter du trafic (à l'import, donc dans chaque worker gunicorn):
+    polices validées et préchargées, reshaper initialisé, un rendu complet pour charger
+    les plugins Pillow et les chemins de code paresseux"""
+    started = time.perf_counter()
+    steps = readiness['steps_ms']
+    try:
+        step = time.perf_counter()
+        valid, invalid = font_registry.validate(app.config['FONTS_FOLDER'])
+        if not valid and app.config['FALLBACK_FONT_DOWNLOAD']:
+            logger.warning("⚠️ Aucune police arabe dans %s, téléchargement d'une police de secours", app.config['FONTS_FOLDER'])
+            download_fallback_font()
+            valid, invalid = font_registry.validate(app.config['FONTS_FOLDER'])
+        readiness.update(fonts=valid, invalid_fonts=invalid)
+        if not valid:
+            logger.critical("❌ ERREUR CRITIQUE: Aucune police arabe disponible! Ajoutez KFGQPC-Uthman-Taha.ttf dans fonts/")
+        font_registry.preload(app.config['FONTS_FOLDER'], names=valid,
+                              sizes=(DEFAULT_CONFIG['font_size'], DEFAULT_CONFIG['footer_font_size']))
+        steps['fonts'] = round((time.perf_counter() - step) * 1000, 1)
+        
+        if app.config['WARMUP']:
+            step = time.perf_counter()
+            shared_reshaper.reshape(WARMUP_TEXT)  # compile la regex des ligatures
+            steps['reshaper'] = round((time.perf_counter() - step) * 1000, 1)
             
+            step = time.perf_counter()
+            config = DEFAULT_CONFIG.copy()
+            config['font_name'] = font_registry.fallback(config['font_name']) or config['font_name']
+            render_duaa_bytes(WARMUP_TEXT, config)
+            steps['render'] = round((time.perf_counter() - step) * 1000, 1)
+        
+        readiness['ready'] = bool(valid)
     except Exception as e:
-        print(f"❌ Erreur job {job_id}: {e}")
-        jobs[job_id]['status'] = 'error'
-        jobs[job_id]['error'] = str(e)
+        readiness['error'] = str(e)
+        logger.exception("❌ Erreur préchauffage: %s", e)
+    readiness['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("🔥 Préchauffage terminé en %.0f ms (%s polices)", readiness['total_ms'], len(readiness['fonts']))
+
+warm_up()
 
 # ============================================
 # ROUTES API
 # ============================================
 
+def queue_full_response(error):
+    """Réponse 429 avec Retry-After quand la file d'attente est pleine"""
+    response = jsonify({'error': 'File d\'attente pleine, réessayez plus tard',
+                        'retry_after': error.retry_after})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
 @app.route('/api/generate', methods=['POST'])
 def api_generate():
     """
@@ -617,69 +3021,384 @@ def api_generate():
         job_id = str(uuid.uuid4())[:8]
         
         # Merger config
-        config = DEFAULT_CONFIG.copy()
-        custom_config = data.get('config', {})
-        config.update(custom_config)
+        config = build_config(data)
+        error = encoder_config_error(config)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Nom de sortie
         output_name = sanitize_filename(data.get('output_name', f"duaa_{job_id}"))
         
         # Créer le job
-        jobs[job_id] = {
+        job_store.create({
             'id': job_id,
-            'status': 'processing',
+            'status': 'queued',
             'progress': 0,
             'duaa_text': duaa_text[:50] + '...' if len(duaa_text) > 50 else duaa_text,
+            'priority': data.get('priority', 'normal'),
             'started_at': datetime.now().isoformat(),
             'finished_at': None,
             'output_path': None,
             'download_url': None,
+            'cache_url': None,
             'error': None
-        }
+        })
         
-        # Lancer le traitement en thread
-        thread = threading.Thread(
-            target=process_image_job,
-            args=(job_id, duaa_text, config, output_name)
-        )
-        thread.daemon = True
-        thread.start()
+        # Multi-formats: toutes les variantes dans un seul job
+        formats = data.get('formats')
+        if formats:
+            unknown = [fmt for fmt in formats if fmt not in PRESET_FORMATS]
+            if unknown:
+                job_store.delete(job_id)
+                return jsonify({'error': f"Formats inconnus: {', '.join(map(str, unknown))}"}), 400
+            job_store.update(job_id, type='fanout', formats=formats)
+            try:
+                scheduler.submit(process_fanout_job, job_id, duaa_text, config, formats, output_name, time.time(),
+                                 priority=data.get('priority', 'normal'))
+            except QueueFullError as e:
+                job_store.delete(job_id)
+                return queue_full_response(e)
+            logger.info("🚀 Job %s en file (%s formats)", job_id, len(formats))
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status': 'queued',
+                'formats': formats,
+                'status_url': f"/api/status/{job_id}",
+                'estimated_time': 5
+            }), 202
+        
+        # Rendu identique déjà disponible: réponse immédiate
+        cache_key = render_cache.key(duaa_text, config)
+        cached_path = render_cache.lookup(cache_key, config)
+        if cached_path is not None:
+            complete_job(job_id, publish_output(cached_path, output_name), cached_path, cache_hit=True)
+            logger.info("♻️ Job %s servi depuis le cache", job_id)
+            job = job_store.get(job_id)
+            job.update({'success': True, 'job_id': job_id, 'status_url': f"/api/status/{job_id}"})
+            return jsonify(job), 200
         
-        print(f"🚀 Job {job_id} démarré")
+        # Rendu identique déjà en cours: le job attend son résultat
+        leader_id = render_cache.join(cache_key, job_id, output_name)
+        if leader_id is not None:
+            job_store.update(job_id, coalesced_with=leader_id)
+            logger.info("🔗 Job %s regroupé avec %s", job_id, leader_id)
+        else:
+            # Mettre le job en file (pool de workers borné)
+            try:
+                scheduler.submit(process_image_job, job_id, duaa_text, config, output_name, time.time(), cache_key,
+                                 priority=data.get('priority', 'normal'))
+            except QueueFullError as e:
+                for waiting_job_id, _ in render_cache.release(cache_key):
+                    job_store.delete(waiting_job_id)
+                logger.warning("⏳ File pleine, job refusé")
+                return queue_full_response(e)
+        
+        logger.info("🚀 Job %s en file", job_id)
         
         return jsonify({
             'success': True,
             'job_id': job_id,
-            'status': 'processing',
+            'status': 'queued',
             'status_url': f"/api/status/{job_id}",
             'estimated_time': 5
         }), 202
         
+    except TemplateNotFoundError as e:
+        return jsonify({'error': f"Template introuvable: {e.args[0]}"}), 404
     except Exception as e:
-        print(f"❌ Erreur API: {e}")
+        logger.error("❌ Erreur API: %s", e)
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/generate/batch', methods=['POST'])
+def api_generate_batch():
+    """
+    Génère plusieurs images en un seul job
+    Body JSON:
+    {
+        "items": [{"duaa_text": "...", "output_name": "...", "config": {...}}, ...],
+        -- ou --
+        "texts": ["...", "..."], "formats": ["instagram_square", "instagram_story"], "configs": [{...}],
+        "config": {...},            (config commune, optionnelle)
+        "output_prefix": "semaine"  (optionnel)
+    }
+    """
+    data = request.get_json(silent=True)
+    
+    if not data:
+        return jsonify({'error': 'Body JSON requis'}), 400
+    
+    job_id = str(uuid.uuid4())[:8]
+    items = expand_batch_items(data, job_id)
+    
+    if not items:
+        return jsonify({'error': 'items ou texts requis'}), 400
+    if any(not item['duaa_text'] for item in items):
+        return jsonify({'error': 'duaa_text requis pour chaque élément'}), 400
+    if len(items) > app.config['BATCH_MAX_ITEMS']:
+        return jsonify({'error': f"Maximum {app.config['BATCH_MAX_ITEMS']} éléments par batch"}), 400
+    for item in items:
+        error = encoder_config_error(item['config'])
+        if error:
+            return jsonify({'error': error}), 400
+    
+    job_store.create({
+        'id': job_id,
+        'type': 'batch',
+        'status': 'queued',
+        'progress': 0,
+        'total_items': len(items),
+        'completed_items': 0,
+        'items': [],
+        'priority': data.get('priority', 'normal'),
+        'started_at': datetime.now().isoformat(),
+        'finished_at': None,
+        'error': None
+    })
+    
+    try:
+        scheduler.submit(process_batch_job, job_id, items, time.time(), priority=data.get('priority', 'normal'))
+    except QueueFullError as e:
+        job_store.delete(job_id)
+        return queue_full_response(e)
+    
+    logger.info("🚀 Batch %s en file (%s éléments)", job_id, len(items))
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'total_items': len(items),
+        'status_url': f"/api/status/{job_id}",
+        'zip_url': f"/api/batch/{job_id}/zip"
+    }), 202
+
+@app.route('/api/batch/<job_id>/zip', methods=['GET'])
+def api_batch_zip(job_id):
+    """Télécharge en streaming un ZIP des images terminées d'un batch"""
+    job = job_store.get(job_id)
+    
+    if not job or job.get('type') != 'batch':
+        return jsonify({'error': 'Batch introuvable'}), 404
+    
+    output_folder = Path(app.config['OUTPUT_FOLDER'])
+    paths = []
+    for item in job.get('items', []):
+        if item['status'] != 'completed':
+            continue
+        path = output_folder / Path(item['download_url']).name
+        try:
+            # Le nom a pu être republié depuis par un autre job (même output_prefix): on n'envoie que le fichier de ce batch
+            if item.get('file_id') and output_file_id(path) != item['file_id']:
+                logger.warning("⚠️ Batch %s: %s a été remplacé par un autre job", job_id, path.name)
+                continue
+        except OSError:
+            continue
+        paths.append(path)
+    
+    if not paths:
+        return jsonify({'error': 'Aucune image terminée'}), 404
+    
+    response = Response(stream_with_context(stream_zip(paths)), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f"attachment; filename=batch_{job_id}.zip"
+    return response
+
+@app.before_request
+def start_janitor():
+    """Démarre le nettoyage périodique dans ce worker (une seule fois par processus)"""
+    janitor.ensure_started()
+
+@app.errorhandler(TemplateNotFoundError)
+def template_not_found(error):
+    return jsonify({'error': f"Template introuvable: {error.args[0]}"}), 404
+
+@app.route('/api/templates', methods=['GET'])
+def api_templates():
+    """Liste les templates enregistrés (avec les temps de rendu de ce worker)"""
+    return jsonify({'templates': template_store.list(), 'base_cache': template_store.bases.stats()})
+
+@app.route('/api/templates', methods=['POST'])
+def api_templates_create():
+    """
+    Enregistre une mise en page réutilisable
+    Body JSON: {"name": "campagne_ramadan", "config": {...}}
+    Les jobs l'utilisent avec "template": "campagne_ramadan"
+    """
+    data = request.get_json(silent=True)
+    
+    if not data or not data.get('name'):
+        return jsonify({'error': 'name requis'}), 400
+    
+    try:
+        template_store.validate_name(data['name'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Précomposer la base avant d'enregistrer: un fond inaccessible ne doit pas donner un template dégradé
+    config = build_config({'config': data.get('config') or {}})
+    width, height = canvas_size(config)
+    probe = {}
+    with metrics.collect(probe):
+        base = compose_base_image(config, width, height)
+    if probe.get('background_fallback'):
+        return jsonify({'error': f"Fond du template inaccessible: {config['background_image']}"}), 502
+    
+    template = template_store.save(data['name'], data.get('config') or {})
+    config = build_config({'template': template['name']})
+    template_store.base_image(config, width, height, lambda: base)
+    
+    logger.info("🧩 Template %s enregistré (version %s)", template['name'], template['version'])
+    return jsonify(template), 201
+
+@app.route('/api/templates/<name>', methods=['GET'])
+def api_template(name):
+    """Détail d'un template"""
+    try:
+        template = template_store.get(name)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if template is None:
+        return jsonify({'error': 'Template introuvable'}), 404
+    template['render_stats'] = template_store.render_stats(name)
+    return jsonify(template)
+
+@app.route('/api/templates/<name>/invalidate', methods=['POST'])
+def api_template_invalidate(name):
+    """Force la recomposition de la base (ex: l'image de fond a changé à la même URL)"""
+    try:
+        template = template_store.invalidate(name)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if template is None:
+        return jsonify({'error': 'Template introuvable'}), 404
+    return jsonify(template)
+
+@app.route('/api/templates/<name>', methods=['DELETE'])
+def api_template_delete(name):
+    """Supprime un template"""
+    try:
+        deleted = template_store.delete(name)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not deleted:
+        return jsonify({'error': 'Template introuvable'}), 404
+    return jsonify({'success': True, 'name': name})
+
+@app.route('/api/render', methods=['POST'])
+def api_render():
+    """
+    Génère une image de dou'a et renvoie directement les octets (PNG/JPEG)
+    Même body JSON que /api/generate - rien n'est écrit sur le disque
+    """
+    data = request.get_json(silent=True)
+    
+    if not data:
+        return jsonify({'error': 'Body JSON requis'}), 400
+    
+    duaa_text = data.get('duaa_text')
+    
+    if not duaa_text:
+        return jsonify({'error': 'duaa_text requis'}), 400
+    
+    config = build_config(data)
+    error = encoder_config_error(config)
+    if error:
+        return jsonify({'error': error}), 400
+    fmt = OUTPUT_FORMATS[output_format(config)]
+    output_name = sanitize_filename(data.get('output_name', 'duaa'))
+    
+    cached_path = render_cache.lookup(render_cache.key(duaa_text, config), config)
+    if cached_path is not None:
+        try:
+            image_bytes = cached_path.read_bytes()
+        except OSError:
+            cached_path = None
+    
+    if cached_path is None:
+        try:
+            future = scheduler.submit(render_engine.render_duaa_bytes, duaa_text, config, priority=data.get('priority', 'high'))
+        except QueueFullError as e:
+            return queue_full_response(e)
+        
+        try:
+            image_bytes = future.result(timeout=app.config['RENDER_TIMEOUT'])
+        except Exception as e:
+            logger.error("❌ Erreur rendu: %s", e)
+            return jsonify({'error': str(e)}), 500
+    
+    response = Response(image_bytes, mimetype=fmt['mimetype'])
+    response.headers['Content-Disposition'] = f"inline; filename={output_name}.{fmt['ext']}"
+    response.set_etag(hashlib.sha256(image_bytes).hexdigest())
+    return response
+
 @app.route('/api/status/<job_id>', methods=['GET'])
 def api_status(job_id):
-    """Vérifie le statut d'un job"""
-    job = jobs.get(job_id)
+    """Vérifie le statut d'un job
+    ?wait=N: attend jusqu'à N secondes que le job soit terminé (long-poll)"""
+    job = job_store.get(job_id)
     
     if not job:
         return jsonify({'error': 'Job introuvable'}), 404
     
+    wait = min(request.args.get('wait', 0, type=float), app.config['STATUS_MAX_WAIT'])
+    deadline = time.monotonic() + wait
+    while job['status'] not in ('completed', 'error') and time.monotonic() < deadline:
+        # Réveil immédiat si le job tourne dans ce worker, sinon relecture périodique du store
+        with job_events:
+            job_events.wait(timeout=min(0.25, max(deadline - time.monotonic(), 0)))
+        job = job_store.get(job_id) or job
+    
     return jsonify(job)
 
+# Empreintes des fichiers servis, par inode: une image publiée (lien physique vers ca-*) partage celle du cache
+download_etags = LRUCache(maxsize=4096)
+DOWNLOAD_NAME_RE = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9._-]{0,199}$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+def file_etag(path, stat):
+    """ETag fort: SHA-256 du contenu, calculé une fois tant que le fichier ne change pas"""
+    def digest():
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()[:32]
+    return download_etags.get_or_create((stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size), digest)
+
 @app.route('/api/download/<filename>', methods=['GET'])
 def api_download(filename):
-    """Télécharge une image générée"""
+    """Télécharge une image générée (ETag, If-None-Match -> 304, Range, ?inline=1 pour l'afficher)"""
     filepath = Path(app.config['OUTPUT_FOLDER']) / filename
     
-    if not filepath.exists():
+    if not DOWNLOAD_NAME_RE.match(filename) or filename.endswith('.tmp') or not filepath.is_file():
         return jsonify({'error': 'Fichier introuvable'}), 404
     
-    return send_file(filepath, as_attachment=True)
+    stat = filepath.stat()
+    # Un nom ca-<clé> désigne toujours le même contenu: cache permanent côté client et CDN
+    immutable = filename.startswith('ca-')
+    # conditional=True: 304 et réponses partielles 206 gérés par werkzeug;
+    # le fichier passe par wsgi.file_wrapper (sendfile sous gunicorn) sans être lu en Python
+    response = send_file(
+        filepath,
+        as_attachment=request.args.get('inline') not in ('1', 'true'),
+        etag=file_etag(filepath, stat),
+        last_modified=stat.st_mtime,
+        conditional=True,
+        max_age=IMMUTABLE_MAX_AGE if immutable else 0
+    )
+    response.accept_ranges = 'bytes'
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True  # nom réutilisable: revalider avec l'ETag
+    return response
+
+@app.route('/api/ready', methods=['GET'])
+def api_ready():
+    """Prêt à recevoir du trafic: préchauffage terminé et au moins une police arabe valide (503 sinon)"""
+    return jsonify(readiness), 200 if readiness['ready'] else 503
 
 @app.route('/api/health', methods=['GET'])
 def health():
@@ -687,15 +3406,124 @@ def health():
     return jsonify({
         'status': 'healthy',
         'version': '1.0',
-        'jobs_count': len(jobs)
+        'jobs_count': job_store.count(),
+        'job_store': app.config['JOB_STORE'],
+        'render_cache': render_cache.stats(),
+        'queue': scheduler.stats(),
+        'font_cache': font_registry.stats(),
+        'shaping_cache': shaping_cache.stats(),
+        'word_width_cache': word_width_cache.stats(),
+        'gradient_cache': gradient_cache.stats(),
+        'text_mask_cache': text_masks.stats(),
+        'encoder': encoder_stats.stats(),
+        'render_engine': render_engine.stats(),
+        'downloads': downloader.stats(),
+        'stages': metrics.summary(),
+        'logs_dropped': log_throttle.drop_counts(),
+        'janitor': janitor.stats(),
+        'background_cache': {
+            'sources': background_sources.stats(),
+            'processed': processed_backgrounds.stats()
+        }
     })
 
+def _prometheus_labels(labels):
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}' if labels else ''
+
+def prometheus_metrics():
+    """Métriques de ce worker au format texte Prometheus"""
+    lines = []
+    
+    def family(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_prometheus_labels(labels)} {value}")
+    
+    # Histogrammes de durée
+    histograms = OrderedDict()
+    for metric, labels, buckets, counts, total, count in metrics.snapshot():
+        histograms.setdefault(metric, []).append((labels, buckets, counts, total, count))
+    help_texts = {
+        'duaa_stage_duration_seconds': "Durée de chaque étape du rendu",
+        'duaa_job_duration_seconds': "Durée d'exécution des jobs par type",
+        'duaa_queue_wait_seconds': "Attente dans la file avant exécution"
+    }
+    for metric, series in histograms.items():
+        lines.append(f"# HELP {metric} {help_texts.get(metric, metric)}")
+        lines.append(f"# TYPE {metric} histogram")
+        for labels, buckets, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f"{metric}_bucket{_prometheus_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{metric}_sum{_prometheus_labels(labels)} {total}")
+            lines.append(f"{metric}_count{_prometheus_labels(labels)} {count}")
+    
+    # File d'attente
+    queue_stats = scheduler.stats()
+    family('duaa_queue_depth', 'gauge', "Jobs en attente dans la file", [((), queue_stats['queued'])])
+    family('duaa_queue_running', 'gauge', "Jobs en cours d'exécution", [((), queue_stats['running'])])
+    family('duaa_queue_capacity', 'gauge', "Taille max de la file", [((), queue_stats['queue_size'])])
+    family('duaa_jobs_total', 'counter', "Jobs traités par résultat", [
+        ((('result', 'completed'),), queue_stats['completed']),
+        ((('result', 'failed'),), queue_stats['failed']),
+        ((('result', 'rejected'),), queue_stats['rejected'])
+    ])
+    
+    # Caches
+    caches = {
+        'font': font_registry.stats(),
+        'shaping': shaping_cache.stats(),
+        'word_width': word_width_cache.stats(),
+        'gradient': gradient_cache.stats(),
+        'text_mask': text_masks.stats(),
+        'background_source': background_sources.stats(),
+        'background_processed': processed_backgrounds.stats(),
+        'template_base': template_store.bases.stats(),
+        'render': render_cache.stats()
+    }
+    family('duaa_cache_hits_total', 'counter', "Lectures servies par le cache",
+           [((('cache', name),), stats['hits']) for name, stats in caches.items()])
+    family('duaa_cache_misses_total', 'counter', "Lectures absentes du cache",
+           [((('cache', name),), stats['misses']) for name, stats in caches.items()])
+    family('duaa_cache_hit_ratio', 'gauge', "Taux de succès du cache",
+           [((('cache', name),), stats['hit_rate']) for name, stats in caches.items()])
+    family('duaa_cache_bytes', 'gauge', "Octets occupés par le cache",
+           [((('cache', name),), stats['bytes']) for name, stats in caches.items() if 'bytes' in stats])
+    family('duaa_render_cache_coalesced_total', 'counter', "Requêtes rattachées à un rendu identique en cours",
+           [((), caches['render']['coalesced'])])
+    
+    # Téléchargements et logs
+    downloads = downloader.stats()
+    family('duaa_downloads_total', 'counter', "Téléchargements HTTP", [((), downloads['requests'])])
+    family('duaa_download_bytes_total', 'counter', "Octets téléchargés", [((), downloads['bytes'])])
+    family('duaa_download_rejected_total', 'counter', "Téléchargements refusés ou échoués", [
+        ((('reason', 'too_large'),), downloads['too_large']),
+        ((('reason', 'host_busy'),), downloads['host_busy']),
+        ((('reason', 'error'),), downloads['errors'])
+    ])
+    janitor_stats = janitor.stats()
+    family('duaa_janitor_evictions_total', 'counter', "Éléments supprimés par le nettoyage périodique",
+           [((('kind', kind),), count) for kind, count in janitor_stats['evicted'].items()])
+    family('duaa_output_bytes', 'gauge', "Octets des images publiées dans outputs/", [((), janitor_stats['outputs_bytes'])])
+    family('duaa_logs_dropped_total', 'counter', "Lignes de log supprimées",
+           [((('reason', reason),), count) for reason, count in log_throttle.drop_counts().items()])
+    return '\n'.join(lines) + '\n'
+
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    """Métriques Prometheus (par worker gunicorn)"""
+    return Response(prometheus_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/formats', methods=['GET'])
 def api_formats():
     """Liste les formats disponibles"""
     return jsonify({
         'formats': PRESET_FORMATS,
-        'default': 'instagram_square'
+        'default': 'instagram_square',
+        'output_formats': available_output_formats(),
+        'encoder_profiles': list(ENCODER_PROFILES)
     })
 
 @app.route('/api/docs', methods=['GET'])
@@ -709,24 +3537,63 @@ def docs():
                 'body': {
                     'duaa_text': 'string (requis) - Le texte de la dou\'a en arabe',
                     'output_name': 'string (optionnel) - Nom du fichier de sortie',
+                    'priority': 'string (optionnel) - high, normal (défaut) ou low',
+                    'template': 'string (optionnel) - Nom d\'un template enregistré (sa config sert de base)',
+                    'formats': 'array (optionnel) - Liste de formats: un seul job rend toutes les variantes (champ "variants" du statut)',
                     'config': {
                         'format': 'string - instagram_square, instagram_story, facebook_post, etc.',
                         'font_size': 'number - Taille de la police',
                         'text_color': 'string hex - Couleur du texte',
                         'background_color': 'string hex - Couleur de fond',
                         'background_image': 'string - URL ou nom du fichier de fond',
+                        'background_gradient': 'object - {"type": "vertical|horizontal|diagonal|radial", "colors": [hex...], "stops": [0-1...]}',
+                        'text_outline': 'boolean - Contour du texte (outline_width, outline_color)',
+                        'auto_fit': 'boolean - Taille de police automatique (bornes min_font_size/max_font_size, cadre max_width_percent × max_height_percent)',
+                        'shadow_blur': 'number - Rayon de flou de l\'ombre (0 = ombre nette)',
                         'add_footer': 'boolean - Ajouter un footer',
                         'footer_text': 'string - Texte du footer'
                     }
                 }
             },
+            '/api/generate/batch': {
+                'method': 'POST',
+                'description': 'Génère plusieurs images en un job: "items" [{duaa_text, output_name, config}] ou "texts" × "formats" × "configs"'
+            },
+            '/api/batch/:job_id/zip': {
+                'method': 'GET',
+                'description': 'ZIP (streaming) des images terminées d\'un batch'
+            },
+            '/api/metrics': {
+                'method': 'GET',
+                'description': 'Métriques Prometheus: durées par étape, file d\'attente, caches, logs supprimés'
+            },
+            '/api/templates': {
+                'method': 'GET, POST',
+                'description': 'Liste les templates / enregistre un template {"name", "config"}'
+            },
+            '/api/templates/:name': {
+                'method': 'GET, DELETE',
+                'description': 'Détail (avec temps de rendu) ou suppression d\'un template'
+            },
+            '/api/templates/:name/invalidate': {
+                'method': 'POST',
+                'description': 'Force la recomposition de la base du template'
+            },
+            '/api/render': {
+                'method': 'POST',
+                'description': 'Génère une image et renvoie directement les octets PNG/JPEG (même body que /api/generate)'
+            },
             '/api/status/:job_id': {
                 'method': 'GET',
-                'description': 'Vérifie le statut d\'un job'
+                'description': 'Vérifie le statut d\'un job (?wait=N pour attendre jusqu\'à N secondes la fin du job)'
+            },
+            '/api/ready': {
+                'method': 'GET',
+                'description': 'Prêt à recevoir du trafic (503 tant que le préchauffage n\'a pas trouvé de police arabe)'
             },
             '/api/download/:filename': {
                 'method': 'GET',
-                'description': 'Télécharge une image générée'
+                'description': 'Télécharge une image générée (ETag et If-None-Match, Range, ?inline=1 pour l\'afficher dans le navigateur)'
             },
             '/api/formats': {
                 'method': 'GET',
@@ -0,0 +1,728 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks du générateur d'images Dou'a (hors ligne, polices de fonts/)
+Usage: python3 bench_duaa_images.py wrap [--repeat 20]
+       python3 bench_duaa_images.py background [--repeat 5]
+       python3 bench_duaa_images.py effects [--repeat 10]
+       python3 bench_duaa_images.py fanout [--repeat 3]
+       python3 bench_duaa_images.py masks [--repeat 5]
+       python3 bench_duaa_images.py encode [--repeat 5]
+       python3 bench_duaa_images.py download [--repeat 50]
+       python3 bench_duaa_images.py pipeline [--repeat 10] [--full] [--cold] [--json avant.json]
+       python3 bench_duaa_images.py load [--clients 8] [--requests 200] [--url http://...] [--json charge.json]
+       python3 bench_duaa_images.py compare avant.json apres.json
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import resource
+import statistics
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+import api_duaa_images as api
+
+SAMPLE_WORDS = (
+    "اللَّهُمَّ إِنِّي أَسْأَلُكَ الْجَنَّةَ وَأَعُوذُ بِكَ مِنَ النَّارِ "
+    "رَبَّنَا آتِنَا فِي الدُّنْيَا حَسَنَةً وَفِي الْآخِرَةِ حَسَنَةً وَقِنَا عَذَابَ النَّارِ "
+    "سُبْحَانَ اللهِ وَبِحَمْدِهِ سُبْحَانَ اللهِ الْعَظِيمِ"
+).split()
+
+def sample_text(n_words):
+    """Texte arabe de n mots construit à partir d'invocations courantes"""
+    return ' '.join(SAMPLE_WORDS[i % len(SAMPLE_WORDS)] for i in range(n_words))
+
+def timed(fn, repeat):
+    """Exécute fn `repeat` fois et retourne la médiane en millisecondes"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def legacy_wrap_text(text, font, max_width):
+    """Ancienne version de wrap_text (mesure de la ligne entière à chaque mot)"""
+    words = text.split()
+    lines = []
+    current_line = []
+    for word in words:
+        test_line = ' '.join(current_line + [word])
+        bbox = font.getbbox(test_line)
+        if bbox[2] - bbox[0] <= max_width:
+            current_line.append(word)
+        else:
+            if current_line:
+                lines.append(' '.join(current_line))
+            current_line = [word]
+    if current_line:
+        lines.append(' '.join(current_line))
+    return lines
+
+def bench_wrap(args):
+    font = api.get_font(api.DEFAULT_CONFIG['font_name'], api.DEFAULT_CONFIG['font_size'])
+    max_width = int(1080 * api.DEFAULT_CONFIG['max_width_percent'] / 100)
+    print(f"{'mots':>6} {'legacy ms':>10} {'greedy froid':>13} {'greedy chaud':>13} {'balanced':>10}")
+    for n_words in (50, 100, 200, 500):
+        text = sample_text(n_words)
+        legacy = timed(lambda: legacy_wrap_text(text, font, max_width), args.repeat)
+
+        def cold():
+            api.word_width_cache.clear()
+            api.shaping_cache.clear()
+            api.wrap_text(text, font, max_width)
+
+        greedy_cold = timed(cold, args.repeat)
+        greedy_warm = timed(lambda: api.wrap_text(text, font, max_width), args.repeat)
+        balanced = timed(lambda: api.wrap_text(text, font, max_width, 'balanced'), args.repeat)
+        print(f"{n_words:>6} {legacy:>10.2f} {greedy_cold:>13.2f} {greedy_warm:>13.2f} {balanced:>10.2f}")
+
+SAMPLE_SIZES = ((4000, 3000), (6000, 4000))
+
+def sample_photo(width, height):
+    """Génère (une fois) une photo JPEG de test: dégradés + bruit, proche d'une vraie photo CDN"""
+    path = Path(api.app.config['TEMP_FOLDER']) / 'bench' / f"sample_{width}x{height}.jpg"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        base = api.render_gradient(width, height, {'type': 'diagonal', 'colors': ['#203a43', '#d4a373', '#0f2027']})
+        noise = Image.effect_noise((width, height), 48).convert('RGB')
+        Image.blend(base, noise, 0.25).save(path, 'JPEG', quality=90)
+    return path
+
+def legacy_background(path, width, height, blur):
+    """Ancien pipeline: décodage complet, LANCZOS pleine taille, crop, flou, overlay RGBA"""
+    img = Image.open(path).convert('RGB')
+    img_ratio = img.width / img.height
+    if img_ratio > width / height:
+        new_width, new_height = int(height * img_ratio), height
+    else:
+        new_width, new_height = width, int(width / img_ratio)
+    img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    left, top = (img.width - width) // 2, (img.height - height) // 2
+    img = img.crop((left, top, left + width, top + height))
+    if blur > 0:
+        img = img.filter(ImageFilter.GaussianBlur(radius=blur))
+    overlay = Image.new('RGBA', (width, height), (0, 0, 0, int(255 * 0.6)))
+    return Image.alpha_composite(img.convert('RGBA'), overlay).convert('RGB')
+
+def optimized_background(path, width, height, blur):
+    config = dict(api.DEFAULT_CONFIG, background_blur=blur)
+    return api.process_background(Image.open(path), width, height, config)
+
+def _measure_background(mode, path, width, height, blur, repeat, queue):
+    """Exécuté dans un processus neuf: médiane (ms) et pic RSS ajouté (MB)"""
+    fn = legacy_background if mode == 'legacy' else optimized_background
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    median = timed(lambda: fn(path, width, height, blur), repeat)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((median, (peak - baseline) / 1024))
+
+def bench_background(args):
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{'source':>10} {'flou':>5} {'legacy ms':>10} {'legacy MB':>10} {'optimisé ms':>12} {'optimisé MB':>12}")
+    for size in SAMPLE_SIZES:
+        # Générer l'échantillon dans un processus à part: le pic RSS du parent est hérité par les enfants
+        proc = ctx.Process(target=sample_photo, args=size)
+        proc.start()
+        proc.join()
+        path = sample_photo(*size)
+        for blur in (0, 4, 10):
+            row = []
+            for mode in ('legacy', 'optimized'):
+                queue = ctx.Queue()
+                proc = ctx.Process(target=_measure_background,
+                                   args=(mode, path, 1080, 1920, blur, args.repeat, queue))
+                proc.start()
+                row.extend(queue.get())
+                proc.join()
+            print(f"{size[0]}x{size[1]:<5} {blur:>5} {row[0]:>10.1f} {row[1]:>10.1f} {row[2]:>12.1f} {row[3]:>12.1f}")
+
+def _effect_lines(font):
+    """Lignes reshapées et positionnées d'un texte de 40 mots sur un carré 1080"""
+    lines = api.wrap_text(sample_text(40), font, 918)
+    line_height = int(font.size * 1.5)
+    top = (1080 - len(lines) * line_height) // 2
+    return [(81, top + i * line_height, api.reshape_arabic_text(line)) for i, line in enumerate(lines)]
+
+def legacy_outline(img, lines, font, width):
+    """Ancien contour: (2w+1)² rasterisations par ligne"""
+    draw = ImageDraw.Draw(img)
+    for x, y, line in lines:
+        for adj_x in range(-width, width + 1):
+            for adj_y in range(-width, width + 1):
+                draw.text((x + adj_x, y + adj_y), line, font=font, fill=(0, 0, 0))
+        draw.text((x, y), line, font=font, fill=(255, 255, 255))
+
+def stroke_outline(img, lines, font, width):
+    draw = ImageDraw.Draw(img)
+    for x, y, line in lines:
+        draw.text((x, y), line, font=font, fill=(255, 255, 255), stroke_width=width, stroke_fill=(0, 0, 0))
+
+def bench_effects(args):
+    font = api.get_font(api.DEFAULT_CONFIG['font_name'], api.DEFAULT_CONFIG['font_size'])
+    lines = _effect_lines(font)
+    canvas = Image.new('RGB', (1080, 1080), (26, 71, 42))
+    print(f"{'contour':>8} {'legacy ms':>10} {'stroke ms':>10} {'gain':>6}")
+    for width in range(1, 9):
+        legacy = timed(lambda: legacy_outline(canvas.copy(), lines, font, width), args.repeat)
+        stroke = timed(lambda: stroke_outline(canvas.copy(), lines, font, width), args.repeat)
+        print(f"{width:>8} {legacy:>10.1f} {stroke:>10.1f} {legacy / stroke:>5.1f}x")
+
+    print(f"\n{'ombre':>8} {'ms':>10}")
+    hard = timed(lambda: [ImageDraw.Draw(canvas.copy()).text((x + 3, y + 3), line, font=font, fill=(0, 0, 0))
+                          for x, y, line in lines], args.repeat)
+    print(f"{'nette':>8} {hard:>10.1f}")
+    for radius in (2, 6, 12):
+        soft = timed(lambda: api.draw_soft_shadow(canvas.copy(), lines, font, (3, 3), radius, (0, 0, 0)), args.repeat)
+        print(f"{'douce ' + str(radius):>8} {soft:>10.1f}")
+
+FANOUT_FORMATS = ('instagram_square', 'instagram_story', 'facebook_post', 'twitter_post')
+
+def _clear_render_caches():
+    """Vide les caches en mémoire pour mesurer un rendu à froid"""
+    for cache in (api.processed_backgrounds, api.shaping_cache, api.word_width_cache, api.text_masks):
+        cache.clear()
+
+def bench_fanout(args):
+    import tempfile
+    sample = sample_photo(4000, 3000)
+    api.app.config['BACKGROUNDS_FOLDER'] = str(sample.parent)
+    config = dict(api.DEFAULT_CONFIG, background_image=sample.name, background_blur=4,
+                  add_footer=True, footer_text='@votre_compte', format_output=args.output)
+    text = sample_text(40)
+    original_folder = api.render_cache.folder
+
+    with tempfile.TemporaryDirectory() as folder:
+        api.render_cache.folder = Path(folder)
+
+        def separate():
+            _clear_render_caches()
+            for fmt in FANOUT_FORMATS:
+                api.generate_duaa_image(text, dict(config, format=fmt), str(Path(folder) / f"{fmt}.png"))
+
+        def fanout():
+            _clear_render_caches()
+            for path in Path(folder).glob('ca-*'):
+                path.unlink()
+            api.render_duaa_variants(text, config, FANOUT_FORMATS)
+
+        separate_ms = timed(separate, args.repeat)
+        fanout_ms = timed(fanout, args.repeat)
+    api.render_cache.folder = original_folder
+
+    print(f"{len(FANOUT_FORMATS)} formats, fond JPEG 4000x3000 flouté, sortie {args.output}")
+    print(f"{'appels séparés':>16} {separate_ms:>9.0f} ms")
+    print(f"{'fan-out':>16} {fanout_ms:>9.0f} ms  ({separate_ms / fanout_ms:.2f}x)")
+
+CAMPAIGN_COLORS = ('#FFFFFF', '#F5E6C8', '#FFD700')
+
+def check_masks():
+    """Compare paste_text (masques en cache) à draw.text, pixel par pixel; retourne l'écart max par canal"""
+    texts = [api.reshape_arabic_text(sample_text(6)), api.reshape_arabic_text('بِسْمِ اللَّهِ الرَّحْمَٰنِ الرَّحِيمِ'),
+             '@votre_compte']
+    worst = 0
+    for font_name in ('Amiri-Regular.ttf', 'KFGQPC-Uthman-Taha.ttf'):
+        for size in (30, 80):
+            font = api.get_font(font_name, size)
+            for stroke in (0, 1, 2, 3, 5):
+                for text in texts:
+                    direct = Image.new('RGB', (1600, 300), (26, 71, 42))
+                    cached = direct.copy()
+                    stroke_fill = (0, 0, 0) if stroke else None
+                    ImageDraw.Draw(direct).text((37, 51), text, font=font, fill=(255, 255, 255),
+                                                stroke_width=stroke, stroke_fill=stroke_fill)
+                    api.paste_text(cached, (37, 51), text, font, (255, 255, 255), stroke, stroke_fill)
+                    diff = ImageChops.difference(direct, cached).getextrema()
+                    worst = max(worst, max(high for _, high in diff))
+    return worst
+
+def bench_masks(args):
+    """Campagne templatée: mêmes dou'as déclinées en plusieurs couleurs, même footer, ombre et contour"""
+    worst = check_masks()
+    print(f"écart max avec draw.text (contours 0 à 5 px): {worst}")
+    if worst:
+        raise SystemExit("❌ paste_text ne reproduit pas draw.text")
+    config = dict(api.DEFAULT_CONFIG, add_footer=True, footer_text='@votre_compte', text_shadow=True,
+                  shadow_blur=0, text_outline=True, outline_width=3)
+    texts = [sample_text(n) for n in (12, 18, 24, 30)]
+    campaigns = {
+        'nouveaux textes': [(text + f" {i}", CAMPAIGN_COLORS[0]) for i, text in enumerate(texts)],
+        'déclinaisons couleur': [(text, color) for text in texts for color in CAMPAIGN_COLORS]
+    }
+
+    def run(renders, keep_masks):
+        draw_ms = []
+        for _ in range(args.repeat):
+            api.text_masks.clear()
+            for text, color in renders:
+                if not keep_masks:
+                    api.text_masks.clear()
+                timings = {}
+                api.render_duaa_bytes(text, dict(config, text_color=color), timings=timings)
+                draw_ms.append(timings['draw_ms'])
+        return statistics.median(draw_ms)
+
+    print(f"{'campagne':<22} {'rendus':>6} {'sans cache':>11} {'avec cache':>11} {'gain':>6}")
+    for name, renders in campaigns.items():
+        run(renders, True)  # polices, reshaping et largeurs en cache pour les deux mesures
+        cold = run(renders, False)
+        warm = run(renders, True)
+        print(f"{name:<22} {len(renders):>6} {cold:>9.2f}ms {warm:>9.2f}ms {cold / warm:>5.1f}x")
+    stats = api.text_masks.stats()
+    print(f"\nmasques en cache: {stats['size']}, {stats['bytes'] / 1024:.0f} KB, taux de succès {stats['hit_rate']:.0%}")
+
+def bench_encode(args):
+    sample = sample_photo(4000, 3000)
+    api.app.config['BACKGROUNDS_FOLDER'] = str(sample.parent)
+    backgrounds = {
+        'uni': {},
+        'dégradé': {'background_gradient': {'type': 'diagonal', 'colors': ['#0f2027', '#2c5364']}},
+        'photo': {'background_image': sample.name, 'background_blur': 4}
+    }
+    formats = [fmt for fmt in api.OUTPUT_FORMATS if fmt in api.available_output_formats()]
+    print(f"{'fond':>8} {'format':>6} {'profil':>9} {'ms':>8} {'KB':>8}")
+    for name, options in backgrounds.items():
+        config = dict(api.DEFAULT_CONFIG, **options)
+        img = api.render_duaa_image(sample_text(40), config)
+        legacy_sizes = []
+        legacy = timed(lambda: legacy_sizes.append(len(legacy_png(img, config['quality']))), args.repeat)
+        print(f"{name:>8} {'PNG':>6} {'legacy':>9} {legacy:>8.1f} {legacy_sizes[-1] / 1024:>8.1f}")
+        variants = [(fmt, profile, {}) for fmt in formats for profile in api.ENCODER_PROFILES]
+        variants.append(('PNG', 'fast', {'png_palette': 256}))
+        for fmt, profile, extra in variants:
+            variant = dict(config, format_output=fmt, encoder_profile=profile, **extra)
+            sizes = []
+            ms = timed(lambda: sizes.append(len(api.encode_image(img, variant))), args.repeat)
+            label = profile + ('+pal' if extra else '')
+            print(f"{name:>8} {fmt:>6} {label:>9} {ms:>8.1f} {sizes[-1] / 1024:>8.1f}")
+
+def legacy_png(img, quality):
+    """Ancien encodage PNG (optimize=True: essais zlib exhaustifs)"""
+    buffer = BytesIO()
+    img.save(buffer, 'PNG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+def bomb_png(width, height):
+    """PNG minuscule qui annonce width x height pixels (seul l'en-tête est lu par Image.open)"""
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b'\x00' * 64)) + chunk(b'IEND', b''))
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serveur HTTP local qui imite un CDN: fichier normal, lent, instable, sans fin, bombe PNG"""
+    protocol_version = 'HTTP/1.1'  # keep-alive, comme un CDN
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, data, content_type='image/jpeg'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        if self.path == '/photo.jpg':
+            self._send(server.photo)
+        elif self.path == '/slow.jpg':
+            with server.lock:
+                server.active += 1
+                server.max_active = max(server.max_active, server.active)
+            time.sleep(0.1)
+            with server.lock:
+                server.active -= 1
+            self._send(server.photo)
+        elif self.path == '/flaky.jpg':
+            with server.lock:
+                server.flaky_calls += 1
+                failing = server.flaky_calls <= 2
+            if failing:
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self._send(server.photo)
+        elif self.path == '/endless.jpg':
+            # Pas de Content-Length: seule la limite pendant la lecture peut arrêter le transfert
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            try:
+                for _ in range(1024):
+                    self.wfile.write(b'\xff' * 1024 * 1024)
+            except OSError:
+                pass
+            self.close_connection = True
+        elif self.path == '/bomb.png':
+            self._send(bomb_png(12000, 12000), 'image/png')
+        else:
+            self.send_error(404)
+
+def stand_in_server():
+    """Démarre le serveur local sur un port libre; retourne (serveur, url de base)"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.photo = sample_photo(1600, 1200).read_bytes()
+    server.connections = server.active = server.max_active = server.flaky_calls = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def bench_download(args):
+    import requests
+    server, base = stand_in_server()
+
+    def check(ok, label):
+        print(f"{'✅' if ok else '❌'} {label}")
+
+    server.connections = 0
+    bare = timed(lambda: requests.get(f"{base}/photo.jpg", timeout=30).content, args.repeat)
+    bare_connections = server.connections
+    server.connections = 0
+    pooled = timed(lambda: api.downloader.fetch(f"{base}/photo.jpg"), args.repeat)
+    print(f"{'requests.get':>14} {bare:>8.2f} ms  {bare_connections} connexions")
+    print(f"{'Downloader':>14} {pooled:>8.2f} ms  {server.connections} connexions")
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lambda _: api.downloader.fetch(f"{base}/slow.jpg"), range(16)))
+    check(server.max_active <= api.downloader.per_host,
+          f"au plus {api.downloader.per_host} téléchargements simultanés par hôte (observé: {server.max_active})")
+
+    result = api.download_bytes(f"{base}/flaky.jpg")
+    check(result is not None and server.flaky_calls == 3, "503 puis succès: nouvelle tentative avec attente")
+
+    started = time.perf_counter()
+    result = api.download_bytes(f"{base}/endless.jpg", max_bytes=5 * 1024 * 1024)
+    check(result is None and api.downloader.too_large >= 1,
+          f"flux sans fin coupé à 5 MB ({(time.perf_counter() - started) * 1000:.0f} ms)")
+
+    config = dict(api.DEFAULT_CONFIG, background_image=f"{base}/bomb.png")
+    check(api.prepare_backgrounds(config, [(1080, 1080)]) == {}, "PNG 12000x12000 (> MAX_IMAGE_PIXELS) refusé sans être décodé")
+    server.shutdown()
+
+# Balayage du pipeline complet: un axe à la fois autour du cas de base (--full: toutes les combinaisons)
+PIPELINE_BASE = {'words': 40, 'format': 'instagram_square', 'effects': 'shadow', 'output': 'PNG', 'background': 'photo'}
+PIPELINE_EFFECTS = {
+    'plain': {'text_shadow': False},
+    'shadow': {},
+    'soft_shadow': {'shadow_blur': 6},
+    'outline': {'text_outline': True, 'outline_width': 4},
+    'blur': {'background_blur': 8}
+}
+PIPELINE_BACKGROUNDS = {
+    'color': {},
+    'gradient': {'background_gradient': {'type': 'diagonal', 'colors': ['#0f2027', '#203a43', '#2c5364']}},
+    'photo': {'background_image': 'sample_4000x3000.jpg'}
+}
+PIPELINE_AXES = {
+    'words': (10, 40, 120, 300),
+    'format': tuple(api.PRESET_FORMATS),
+    'effects': tuple(PIPELINE_EFFECTS),
+    'output': ('PNG', 'JPEG', 'WEBP'),
+    'background': tuple(PIPELINE_BACKGROUNDS)
+}
+
+def pipeline_cases(full):
+    """Liste des cas [(nom, paramètres)] du balayage"""
+    if full:
+        axes = list(PIPELINE_AXES)
+        return [(','.join(f"{axis}={value}" for axis, value in zip(axes, values)), dict(zip(axes, values)))
+                for values in itertools.product(*PIPELINE_AXES.values())]
+    cases = {'base': dict(PIPELINE_BASE)}
+    for axis, values in PIPELINE_AXES.items():
+        for value in values:
+            if value != PIPELINE_BASE[axis]:
+                cases[f"{axis}={value}"] = dict(PIPELINE_BASE, **{axis: value})
+    return list(cases.items())
+
+def pipeline_config(params):
+    config = dict(api.DEFAULT_CONFIG, format=params['format'], format_output=params['output'])
+    config.update(PIPELINE_EFFECTS[params['effects']])
+    config.update(PIPELINE_BACKGROUNDS[params['background']])
+    return config
+
+def stage_summary(samples):
+    """p50/p95 (ms) de chaque étape sur une liste de dicts timings"""
+    stages = {}
+    for key in sorted({key for timings in samples for key in timings if key.endswith('_ms')}):
+        values = sorted(timings.get(key, 0.0) for timings in samples)
+        stages[key[:-3]] = {'p50': api.percentile(values, 0.5), 'p95': api.percentile(values, 0.95)}
+    return stages
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _run_pipeline_case(params, repeat, warmup, cold, backgrounds_folder, queue):
+    """Exécuté dans un processus neuf (pic RSS propre au cas)"""
+    api.app.config['BACKGROUNDS_FOLDER'] = backgrounds_folder
+    config = pipeline_config(params)
+    text = sample_text(params['words'])
+    output_path = Path(api.app.config['TEMP_FOLDER']) / 'bench' / f"pipeline_{os.getpid()}.{api.OUTPUT_FORMATS[api.output_format(config)]['ext']}"
+    samples, totals = [], []
+    for i in range(warmup + repeat):
+        if cold:
+            _clear_render_caches()
+        timings = {}
+        started = time.perf_counter()
+        if not api.generate_duaa_image(text, config, str(output_path), timings=timings):
+            raise RuntimeError(f"Échec du rendu: {params}")
+        if i >= warmup:
+            totals.append((time.perf_counter() - started) * 1000)
+            samples.append(timings)
+    output_path.unlink(missing_ok=True)
+    totals.sort()
+    queue.put({
+        'total': {'p50': api.percentile(totals, 0.5), 'p95': api.percentile(totals, 0.95),
+                  'mean': statistics.mean(totals)},
+        'stages': stage_summary(samples),
+        'bytes': samples[-1].get('bytes', 0),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    })
+
+def bench_metadata():
+    """Contexte de la mesure, pour comparer deux résultats en connaissance de cause"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        commit = None
+    from PIL import __version__ as pillow_version
+    return {
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pillow': pillow_version,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count()
+    }
+
+def save_results(path, kind, results, args):
+    if path:
+        options = {k: v for k, v in vars(args).items() if k not in ('func', 'json')}
+        Path(path).write_text(json.dumps({'kind': kind, 'meta': bench_metadata(), 'options': options,
+                                          'results': results}, indent=2, ensure_ascii=False))
+        print(f"\nRésultats enregistrés dans {path}")
+
+def bench_pipeline(args):
+    ctx = multiprocessing.get_context('spawn')
+    proc = ctx.Process(target=sample_photo, args=(4000, 3000))
+    proc.start()
+    proc.join()
+    backgrounds_folder = str(sample_photo(4000, 3000).parent)
+
+    results = {}
+    print(f"{'cas':<28} {'p50 ms':>8} {'p95 ms':>8} {'fond':>7} {'texte':>7} {'encod.':>7} {'KB':>7} {'RSS MB':>7}")
+    for name, params in pipeline_cases(args.full):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run_pipeline_case,
+                           args=(params, args.repeat, args.warmup, args.cold, backgrounds_folder, queue))
+        proc.start()
+        result = queue.get()
+        proc.join()
+        result['params'] = params
+        results[name] = result
+        stages = result['stages']
+        text_ms = stages.get('layout', {}).get('p50', 0) + stages.get('draw', {}).get('p50', 0)
+        print(f"{name:<28} {result['total']['p50']:>8.1f} {result['total']['p95']:>8.1f} "
+              f"{stages.get('compose', {}).get('p50', 0):>7.1f} {text_ms:>7.1f} "
+              f"{stages.get('encode', {}).get('p50', 0):>7.1f} {result['bytes'] / 1024:>7.1f} {result['peak_rss_mb']:>7.1f}")
+    save_results(args.json, 'pipeline', results, args)
+
+def bench_load(args):
+    import requests
+    server = None
+    base_url = args.url
+    if not base_url:
+        # Application servie dans ce processus (serveur werkzeug multi-thread)
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        server = make_server('127.0.0.1', 0, api.app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+    base_url = base_url.rstrip('/')
+
+    local = threading.local()
+    run_id = os.getpid()
+    formats = tuple(api.PRESET_FORMATS)
+
+    def one_request(index):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        # Texte unique par requête (sauf --cache-hits): on mesure des rendus, pas le cache
+        text = sample_text(20 + index % 40) + ('' if args.cache_hits else f" {run_id}-{index}")
+        body = {'duaa_text': text, 'config': {'format': formats[index % len(formats)],
+                                               'format_output': args.output}}
+        started = time.perf_counter()
+        if args.endpoint == 'render':
+            response = session.post(f"{base_url}/api/render", json=body, timeout=300)
+            status = response.status_code
+        else:
+            response = session.post(f"{base_url}/api/generate", json=body, timeout=300)
+            status = response.status_code
+            if status in (200, 202):
+                job = session.get(f"{base_url}/api/status/{response.json()['job_id']}?wait=60", timeout=300).json()
+                status = 200 if job.get('status') == 'completed' else 500
+        return status, (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        outcomes = list(pool.map(one_request, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(ms for status, ms in outcomes if status == 200)
+    statuses = {}
+    for status, _ in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    result = {
+        'clients': args.clients,
+        'requests': args.requests,
+        'endpoint': args.endpoint,
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'latency_ms': {q: round(api.percentile(latencies, p), 1)
+                       for q, p in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))},
+        'statuses': statuses,
+        'server_stages': requests.get(f"{base_url}/api/health", timeout=30).json().get('stages', {})
+    }
+    if server is not None:
+        result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+        server.shutdown()
+
+    print(f"{args.requests} requêtes {args.endpoint}, {args.clients} clients, sortie {args.output}")
+    print(f"débit: {result['throughput_rps']} img/s   latence p50 {result['latency_ms']['p50']} ms, "
+          f"p95 {result['latency_ms']['p95']} ms, p99 {result['latency_ms']['p99']} ms")
+    print(f"statuts: {statuses}" + (f"   pic RSS: {result['peak_rss_mb']} MB" if server is not None else ''))
+    print(f"\n{'étape (serveur)':<16} {'p50 ms':>8} {'p95 ms':>8}")
+    for stage, stats in result['server_stages'].items():
+        print(f"{stage:<16} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f}")
+    save_results(args.json, 'load', {'load': result}, args)
+
+def bench_compare(args):
+    """Compare deux fichiers JSON (p50 total et par étape); signale les écarts au-delà du seuil"""
+    before = json.loads(Path(args.before).read_text())
+    after = json.loads(Path(args.after).read_text())
+    print(f"avant: {before['meta'].get('commit')} ({before['meta']['date']})   "
+          f"après: {after['meta'].get('commit')} ({after['meta']['date']})\n")
+
+    def flag(old, new):
+        if not old:
+            return ''
+        ratio = new / old
+        if ratio > 1 + args.threshold:
+            return '  ⚠️ plus lent'
+        if ratio < 1 - args.threshold:
+            return '  ✅ plus rapide'
+        return ''
+
+    if before['kind'] == 'load':
+        old, new = before['results']['load'], after['results']['load']
+        print(f"{'mesure':<14} {'avant':>10} {'après':>10}")
+        print(f"{'img/s':<14} {old['throughput_rps']:>10} {new['throughput_rps']:>10}"
+              f"{flag(new['throughput_rps'], old['throughput_rps'])}")
+        for q in ('p50', 'p95', 'p99'):
+            print(f"{'latence ' + q:<14} {old['latency_ms'][q]:>10} {new['latency_ms'][q]:>10}"
+                  f"{flag(old['latency_ms'][q], new['latency_ms'][q])}")
+        return
+
+    print(f"{'cas / étape':<36} {'avant ms':>9} {'après ms':>9} {'ratio':>6}")
+    for name, old in before['results'].items():
+        new = after['results'].get(name)
+        if new is None:
+            continue
+        old_ms, new_ms = old['total']['p50'], new['total']['p50']
+        print(f"{name:<36} {old_ms:>9.1f} {new_ms:>9.1f} {new_ms / old_ms:>6.2f}{flag(old_ms, new_ms)}")
+        if args.stages:
+            for stage, stats in old['stages'].items():
+                new_stage = new['stages'].get(stage, {}).get('p50', 0.0)
+                ratio = f"{new_stage / stats['p50']:>6.2f}" if stats['p50'] else f"{'-':>6}"
+                print(f"  {stage:<34} {stats['p50']:>9.1f} {new_stage:>9.1f} {ratio}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    wrap = sub.add_parser('wrap', help="Découpage en lignes sur des textes de 50 à 500 mots")
+    wrap.add_argument('--repeat', type=int, default=20)
+    wrap.set_defaults(func=bench_wrap)
+
+    background = sub.add_parser('background', help="Chargement d'un fond JPEG 4000-6000 px vers une story 1080x1920")
+    background.add_argument('--repeat', type=int, default=5)
+    background.set_defaults(func=bench_background)
+
+    effects = sub.add_parser('effects', help="Contour (largeurs 1 à 8) et ombres nette/douce")
+    effects.add_argument('--repeat', type=int, default=10)
+    effects.set_defaults(func=bench_effects)
+
+    fanout = sub.add_parser('fanout', help="Une dou'a en 4 formats: appels séparés vs fan-out")
+    fanout.add_argument('--repeat', type=int, default=3)
+    fanout.add_argument('--output', default='JPEG', choices=('PNG', 'JPEG'))
+    fanout.set_defaults(func=bench_fanout)
+
+    masks = sub.add_parser('masks', help="Dessin du texte avec et sans le cache des masques (campagne templatée)")
+    masks.add_argument('--repeat', type=int, default=5)
+    masks.set_defaults(func=bench_masks)
+
+    encode = sub.add_parser('encode', help="Temps et poids par format et profil d'encodage (fonds uni, dégradé, photo)")
+    encode.add_argument('--repeat', type=int, default=5)
+    encode.set_defaults(func=bench_encode)
+
+    download = sub.add_parser('download', help="Téléchargements via un serveur HTTP local: pool, limites, reprises")
+    download.add_argument('--repeat', type=int, default=50)
+    download.set_defaults(func=bench_download)
+
+    pipeline = sub.add_parser('pipeline', help="generate_duaa_image de bout en bout: longueur, formats, effets, sortie, fond")
+    pipeline.add_argument('--repeat', type=int, default=10)
+    pipeline.add_argument('--warmup', type=int, default=1, help="Rendus ignorés au début de chaque cas")
+    pipeline.add_argument('--full', action='store_true', help="Toutes les combinaisons au lieu d'un axe à la fois")
+    pipeline.add_argument('--cold', action='store_true', help="Vider les caches en mémoire avant chaque rendu")
+    pipeline.add_argument('--json', help="Fichier de résultats (pour compare)")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    load = sub.add_parser('load', help="Charge HTTP: clients concurrents contre l'application Flask")
+    load.add_argument('--clients', type=int, default=8)
+    load.add_argument('--requests', type=int, default=200)
+    load.add_argument('--endpoint', default='render', choices=('render', 'generate'))
+    load.add_argument('--output', default='PNG', choices=('PNG', 'JPEG', 'WEBP'))
+    load.add_argument('--url', help="Serveur déjà lancé (ex: gunicorn); sinon l'application est servie ici")
+    load.add_argument('--cache-hits', action='store_true', help="Réutiliser les mêmes textes (mesure du cache des rendus)")
+    load.add_argument('--json', help="Fichier de résultats (pour compare)")
+    load.set_defaults(func=bench_load)
+
+    compare = sub.add_parser('compare', help="Compare deux fichiers de résultats JSON")
+    compare.add_argument('before')
+    compare.add_argument('after')
+    compare.add_argument('--threshold', type=float, default=0.10, help="Écart signalé (0.10 = 10 %%)")
+    compare.add_argument('--stages', action='store_true', help="Détail par étape")
+    compare.set_defaults(func=bench_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()